@@ -1,9 +1,68 @@
 #!/usr/bin/python3
 """initialize views"""
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, json, make_response, request
+from flask import Response, stream_with_context
+from itertools import islice
+from models import storage
+from models.base_model import to_dicts
 
 app_views = Blueprint('app_views', __name__, url_prefix='/api/v1')
 
+# objects in a page when ?limit= is not given, and the most allowed
+PAGE_LIMIT = 100
+PAGE_LIMIT_MAX = 1000
+# objects serialized together by stream_json
+STREAM_BATCH = 100
+
+
+def stream_json(objs):
+    """
+    Return a response streaming a JSON list of the objects' dictionaries.
+    objs may be any iterable, such as storage.iter(); each object is
+    serialized as the body is sent, so the list is never built in memory.
+    """
+    def generate():
+        sep = "["
+        objs_left = iter(objs)
+        while True:
+            batch = to_dicts(islice(objs_left, STREAM_BATCH))
+            if not batch:
+                break
+            yield sep + ",".join(json.dumps(d) for d in batch)
+            sep = ","
+        yield "[]" if sep == "[" else "]"
+    return Response(stream_with_context(generate()),
+                    mimetype="application/json")
+
+
+def paged():
+    """
+    Return True if the request asks for a page with ?limit= or ?cursor=.
+    """
+    return "limit" in request.args or "cursor" in request.args
+
+
+def page_json(cls, **filters):
+    """
+    Return a response with the page of the objects of cls matching filters
+    that the request asks for. The cursor of the next page, if any, is
+    sent in the X-Next-Cursor header, to be passed back as ?cursor=.
+    """
+    try:
+        limit = int(request.args.get("limit", PAGE_LIMIT))
+        if limit < 1:
+            raise ValueError("invalid limit")
+        objs, cursor = storage.page(cls, after=request.args.get("cursor"),
+                                    limit=min(limit, PAGE_LIMIT_MAX),
+                                    **filters)
+    except ValueError:
+        return make_response(jsonify({"error": "Invalid limit or cursor"}),
+                             400)
+    response = make_response(jsonify(to_dicts(objs)))
+    if cursor is not None:
+        response.headers["X-Next-Cursor"] = cursor
+    return response
+
 from api.v1.views.index import *
 from api.v1.views.states import *
 from api.v1.views.cities import *
@@ -4,7 +4,7 @@ Module that creates view for Amenity objects handling default
 RESTful API actions
 """
 # Imports app_views blueprint
-from api.v1.views import app_views
+from api.v1.views import app_views, page_json, paged, stream_json
 # Import necessary Flask modules
 from flask import jsonify, abort, request, make_response
 # Imports storage engine and Amenity model from models module
@@ -19,11 +19,9 @@ def amenities_get():
     """
     Retrieves list of all Amenity objects.
     """
-    all_amenities = storage.all(Amenity)
-    amenity_list = []
-    for amenity in all_amenities.values():
-        amenity_list.append(amenity.to_dict())
-    return make_response(jsonify(amenity_list), 200)
+    if paged():
+        return page_json(Amenity)
+    return make_response(stream_json(storage.iter(Amenity)), 200)
 
 
 @app_views.route("/amenities/<amenity_id>", methods=["GET"],
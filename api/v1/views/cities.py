@@ -25,8 +25,9 @@ The script uses the Flask web framework, and the City and State
 objects are managed by a storage system.
 """
 from flask import jsonify, abort, request, make_response
-from api.v1.views import app_views
+from api.v1.views import app_views, page_json, paged
 from models import storage
+from models.base_model import to_dicts
 from models.state import State
 from models.city import City
 
@@ -39,12 +40,11 @@ def cities_in_state(state_id):
     if state_id doesn't exist, endpoint returns 404 error
     """
     state = storage.get(State, state_id)
-    city_list = []
     if state is None:
         abort(404)
-    for city in state.cities:
-        city_list.append(city.to_dict())
-    return make_response(jsonify(city_list))
+    if paged():
+        return page_json(City, state_id=state.id)
+    return make_response(jsonify(to_dicts(state.cities)))
 
 
 @app_views.route("/cities/<string:city_id>", methods=["GET"],
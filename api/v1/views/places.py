@@ -10,6 +10,15 @@ The following routes are implemented:
 - GET /cities/<city_id>/places:
     Retrieves a list of all Place objects linked to a
     City with the given city_id.
+- GET /places:
+    Retrieves the Place objects matching the filters of the query
+    string, such as ?price_by_night__lte=100&max_guest__gte=4.
+- GET /places/nearby:
+    Retrieves the places within ?radius= km of the point ?lat=&lng=,
+    nearest first, each with its distance in km.
+- GET /places/stats:
+    Retrieves the count, min, max and avg of a numeric attribute of
+    the places, per city or per user.
 - GET /places/<place_id>:
     Retrieves a Place object with the given place_id.
 - DELETE /places/<place_id>:
@@ -29,9 +38,14 @@ read-only attributes.
 The script uses the Flask web framework, and the City and Place
 objects are managed by a storage system.
 """
-from api.v1.views import app_views
+from api.v1.views import app_views, page_json, paged
+from api.v1.views import PAGE_LIMIT, PAGE_LIMIT_MAX
 from flask import jsonify, abort, request, make_response
 from models import storage
+from models.base_model import to_dicts
+from models.engine.columnar import COLUMN_OPERATORS, GROUPS, NUMERIC
+from models.engine.geo import position
+from models.engine.query import parse_filter
 from models.place import Place
 from models.city import City
 from models.user import User
@@ -46,13 +60,106 @@ def places_get(city_id):
     city = storage.get(City, city_id)
     if city is None:
         abort(404)
+    elif paged():
+        return page_json(Place, city_id=city.id)
     else:
-        place_list = []
-        # Iterate through Place objects associated w/ city obj
-        for place in city.places:
-            # Append dict representation of each Place obj to place_list
-            place_list.append(place.to_dict())
-        return jsonify(place_list)
+        # dict representation of each Place obj associated w/ city obj
+        return jsonify(to_dicts(city.places))
+
+
+def number(text):
+    """
+    Return the int or float written in text, raise ValueError otherwise.
+    """
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def place_filters():
+    """
+    Return the query filters of the query string, other than limit and
+    offset. Each is attribute=value or attribute__op=value, with attribute
+    one of the numeric attributes of Place, taking numbers, or city_id or
+    user_id, taking ids; __in takes a comma separated list.
+    Raise ValueError for any other.
+    """
+    filters = {}
+    for name, text in request.args.items():
+        if name in ("limit", "offset"):
+            continue
+        attribute, op = parse_filter(name)
+        if op not in COLUMN_OPERATORS or (attribute not in NUMERIC and
+                                          attribute not in GROUPS):
+            raise ValueError("invalid filter: " + name)
+        values = text.split(",") if op == "in" else [text]
+        if attribute in NUMERIC:
+            values = [number(value) for value in values]
+        filters[name] = values if op == "in" else values[0]
+    return filters
+
+
+@app_views.route("/places", methods=["GET"], strict_slashes=False)
+def places_search():
+    """
+    Retrieves the Place objects matching the filters of the query string,
+    see place_filters(), ordered by id. ?limit=, PAGE_LIMIT by default and
+    at most PAGE_LIMIT_MAX, and ?offset= select a slice of them.
+    Returns 400 for an invalid filter, limit or offset.
+    """
+    try:
+        filters = place_filters()
+        limit = int(request.args.get("limit", PAGE_LIMIT))
+        offset = int(request.args.get("offset", 0))
+        if limit < 1 or offset < 0:
+            raise ValueError("invalid limit or offset")
+    except ValueError:
+        return make_response(jsonify({"error": "Invalid filter"}), 400)
+    query = storage.query(Place).filter(**filters).order_by("id")
+    query = query.offset(offset).limit(min(limit, PAGE_LIMIT_MAX))
+    return jsonify(to_dicts(query.all()))
+
+
+@app_views.route("/places/nearby", methods=["GET"], strict_slashes=False)
+def places_nearby():
+    """
+    Retrieves the places within ?radius= km, 10 by default, of the point
+    ?lat=&lng=, nearest first, each with its "distance" in km. ?limit= is
+    PAGE_LIMIT by default and at most PAGE_LIMIT_MAX.
+    Returns 400 for a missing or invalid point, radius or limit.
+    """
+    try:
+        latitude = float(request.args["lat"])
+        longitude = float(request.args["lng"])
+        radius = float(request.args.get("radius", 10))
+        limit = int(request.args.get("limit", PAGE_LIMIT))
+        if (position(latitude, longitude) is None or not radius > 0 or
+                limit < 1):
+            raise ValueError("invalid point, radius or limit")
+    except (KeyError, ValueError):
+        return make_response(jsonify({"error": "Invalid point"}), 400)
+    found = storage.nearby(latitude, longitude, radius,
+                           min(limit, PAGE_LIMIT_MAX))
+    places = to_dicts(place for km, place in found)
+    for place, (km, obj) in zip(places, found):
+        place["distance"] = km
+    return jsonify(places)
+
+
+@app_views.route("/places/stats", methods=["GET"], strict_slashes=False)
+def places_stats():
+    """
+    Retrieves the count, min, max and avg of a numeric attribute of the
+    places, ?attribute= and price_by_night by default, per city, or per
+    user with ?by=user_id.
+    Returns 400 for any other attribute or grouping.
+    """
+    attribute = request.args.get("attribute", "price_by_night")
+    by = request.args.get("by", "city_id")
+    if attribute not in NUMERIC or by not in GROUPS:
+        return make_response(jsonify({"error": "Invalid attribute"}), 400)
+    return jsonify(storage.aggregate(Place, attribute, by))
 
 
 @app_views.route("/places/<string:place_id>", methods=["GET"],
@@ -4,9 +4,10 @@ Module to create view for Place objects handling default
 RESTful API actions
 """
 # Imports
-from api.v1.views import app_views
+from api.v1.views import app_views, page_json, paged
 from flask import jsonify, abort, request, make_response
 from models import storage
+from models.base_model import to_dicts
 from models.place import Place
 from models.review import Review
 from models.user import User
@@ -22,21 +23,13 @@ def place_reviews_get(place_id):
     """
     Retrieves list of all Review objects linked to a Place.
     """
-    # Retrieves dict of all place objects from storage.
-    # Objects are stores in place_dict variable.
-    place_dict = storage.all(Place)
-    review_list = None
-    return_list = []
-    # Iterates thru values of place_dict dictionary. Checks if id of current
-    # place object matches the place_id arg passed to function.
-    for place in place_dict.values():
-        if place.id == place_id:
-            review_list = place.reviews
-    if review_list is None:
+    # Retrieves the place object with the given id from storage.
+    place = storage.get(Place, place_id)
+    if place is None:
         abort(404)
-    for review in review_list:
-        return_list.append(review.to_dict())
-    return jsonify(return_list)
+    if paged():
+        return page_json(Review, place_id=place.id)
+    return jsonify(to_dicts(place.reviews))
 
 
 @app_views.route("/reviews/<string:review_id>", methods=["GET"],
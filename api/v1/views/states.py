@@ -3,7 +3,7 @@
 Module for creating view for State objects handling default
 RESTful API actions
 """
-from api.v1.views import app_views
+from api.v1.views import app_views, page_json, paged, stream_json
 from flask import jsonify, abort, request, make_response
 from models import storage
 from models.state import State
@@ -15,11 +15,9 @@ def state_get():
     """
     Retrieve list of all State objects.
     """
-    all_states = storage.all(State)
-    states_list = []
-    for state in all_states.values():
-        states_list.append(state.to_dict())
-    return make_response(jsonify(states_list))
+    if paged():
+        return page_json(State)
+    return make_response(stream_json(storage.iter(State)))
 
 
 @app_views.route("/states/<state_id>", methods=["GET"],
@@ -4,7 +4,7 @@ Module that creates view for User objects handling default
 RESTful API actions
 """
 # Imports
-from api.v1.views import app_views
+from api.v1.views import app_views, page_json, paged, stream_json
 from flask import jsonify, abort, request, make_response
 from models import storage
 from models.user import User
@@ -16,11 +16,9 @@ def users_get():
     """
     Retrieve list of all User objects.
     """
-    all_users = storage.all(User)
-    user_list = []
-    for user in all_users.values():
-        user_list.append(user.to_dict())
-    return jsonify(user_list)
+    if paged():
+        return page_json(User)
+    return stream_json(storage.iter(User))
 
 
 @app_views.route("/users/<string:user_id>", methods=["GET"],
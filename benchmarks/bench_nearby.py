@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+"""
+Measures how long the grid index takes to find the places near a point
+
+Usage: ./benchmarks/bench_nearby.py [places]
+
+Places (1,000,000 by default) are spread around 1,000 random city
+centers, as GET /api/v1/places/nearby sees them in FileStorage, then
+the 10 nearest within 1 and 5 km of 200 points near those centers are
+looked up.
+"""
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    """indexes the places and times the searches"""
+    sys.path.insert(0, ROOT)
+    from models.engine.geo import GridIndex
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    random.seed(0)
+    centers = [(random.uniform(-60, 60), random.uniform(-180, 180))
+               for i in range(1000)]
+    grid = GridIndex()
+    begin = time.perf_counter()
+    for i in range(count):
+        latitude, longitude = centers[i % len(centers)]
+        grid.set("Place.{}".format(i), latitude + random.gauss(0, 0.1),
+                 longitude + random.gauss(0, 0.1))
+    print("indexed {:,} places in {:.2f}s".format(
+        count, time.perf_counter() - begin))
+    points = [(latitude + random.gauss(0, 0.05),
+               longitude + random.gauss(0, 0.05))
+              for latitude, longitude in random.sample(centers, 200)]
+    for radius in (1, 5):
+        found = 0
+        begin = time.perf_counter()
+        for latitude, longitude in points:
+            found += len(grid.nearby(latitude, longitude, radius, 10))
+        seconds = (time.perf_counter() - begin) / len(points)
+        print("radius {} km: {:.3f} ms per search, {:.1f} places found".
+              format(radius, seconds * 1000, found / len(points)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+"""
+Measures how many objects per second FileStorage.reload() builds
+
+Usage: ./benchmarks/bench_reload.py [records] [revision]
+
+A JSON file of records (1,000,000 by default) is written to a temporary
+directory, then reloaded in a fresh interpreter by the code of this tree
+and by the code of the git revision given, by default the one before
+BaseModel.from_dict() was added, which is extracted with git archive.
+"""
+from datetime import datetime, timedelta
+import io
+import json
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_records(path, count):
+    """writes a JSON file of count Review and Place records to path"""
+    start = datetime(2017, 6, 14, 22, 31, 3)
+    with open(path, "w") as f:
+        f.write("{\n")
+        for i in range(count):
+            id = str(uuid.uuid4())
+            created = (start + timedelta(seconds=i)).isoformat(
+                timespec="microseconds")
+            if i % 2:
+                record = {"id": id, "created_at": created,
+                          "updated_at": created, "__class__": "Review",
+                          "place_id": "p", "user_id": "u", "text": "Nice"}
+            else:
+                updated = (start + timedelta(days=1, seconds=i)).isoformat(
+                    timespec="microseconds")
+                record = {"id": id, "created_at": created,
+                          "updated_at": updated, "__class__": "Place",
+                          "city_id": "c", "user_id": "u", "name": "Loft",
+                          "number_rooms": 2, "price_by_night": 80,
+                          "latitude": 37.77, "longitude": -122.41}
+            key = record["__class__"] + "." + id
+            sep = ",\n" if i < count - 1 else "\n"
+            f.write(json.dumps(key) + ": " + json.dumps(record) + sep)
+        f.write("}")
+
+
+def extract(revision, directory):
+    """extracts the tree of the git revision into directory
+
+    Returns the abbreviated hash of the revision.
+    """
+    if revision is None:
+        added = subprocess.check_output(
+            ["git", "log", "--format=%H", "-S", "def from_dict", "--",
+             "models/base_model.py"], cwd=ROOT, text=True).split()
+        revision = added[-1] + "~1"
+    revision = subprocess.check_output(
+        ["git", "rev-parse", "--short", revision], cwd=ROOT, text=True).strip()
+    data = subprocess.check_output(["git", "archive", revision], cwd=ROOT)
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        tar.extractall(directory)
+    return revision
+
+
+def reload(path, root):
+    """reloads the JSON file at path with the models of the tree at root
+
+    Returns the number of objects and the seconds reload() took.
+    """
+    os.chdir(os.path.dirname(path))
+    sys.path.insert(0, root)
+    import models
+    from models.engine.file_storage import FileStorage
+    FileStorage._FileStorage__file_path = path
+    FileStorage._FileStorage__journal_path = path + ".log"
+    begin = time.perf_counter()
+    models.storage.reload()
+    return models.storage.count(), time.perf_counter() - begin
+
+
+def main():
+    """writes the records and reloads them with both trees"""
+    if len(sys.argv) == 4 and sys.argv[1] == "--reload":
+        count, seconds = reload(sys.argv[2], sys.argv[3])
+        print(count, seconds)
+        return
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    with tempfile.TemporaryDirectory() as directory:
+        base = os.path.join(directory, "base")
+        revision = extract(sys.argv[2] if len(sys.argv) > 2 else None, base)
+        path = os.path.join(directory, "data", "records.json")
+        os.mkdir(os.path.dirname(path))
+        write_records(path, count)
+        rates = {}
+        for name, root in ((revision, base), ("this tree", ROOT)):
+            output = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__), "--reload", path,
+                 root], env=dict(os.environ, HBNB_TYPE_STORAGE="file"))
+            objects, seconds = output.split()
+            rates[name] = int(objects) / float(seconds)
+            print("{:>10} {:>9} objects in {:6.2f}s: {:>9,.0f} objects/s".
+                  format(name, int(objects), float(seconds), rates[name]))
+        print("speedup: {:.2f}x".format(rates["this tree"] / rates[revision]))
+
+
+if __name__ == "__main__":
+    main()
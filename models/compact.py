@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+"""
+Contains the compact representation of the models used in file mode
+"""
+
+# tuple - the types of the class attributes that become fields
+FIELD_TYPES = (str, int, float, list, type(None))
+
+
+class CompactMeta(type):
+    """creates model classes keeping their fields in slots
+
+    Class attributes holding plain values, like name = "" in City, become
+    fields: each gets a slot, and its value is the default read while
+    the field is not set. Other attributes, such as properties, stay on
+    the class. Attributes that are not fields go to the instance
+    __dict__, which Python only allocates once one is set.
+    """
+
+    def __new__(mcs, name, bases, namespace):
+        """creates the class, turning its plain attributes into slots"""
+        slots = tuple(namespace.get("__slots__", ()))
+        defaults = {}
+        for key, value in list(namespace.items()):
+            if not key.startswith("__") and isinstance(value, FIELD_TYPES):
+                defaults[key] = namespace.pop(key)
+        inherited = {}
+        for base in bases:
+            inherited.update(getattr(base, "_slots", {}))
+        namespace["__slots__"] = slots + tuple(key for key in defaults
+                                               if key not in inherited)
+        cls = super().__new__(mcs, name, bases, namespace)
+        cls._slots = dict(inherited)
+        for key in namespace["__slots__"]:
+            if not key.startswith("__"):
+                cls._slots[key] = cls.__dict__[key]
+        cls._defaults = {}
+        for base in reversed(bases):
+            cls._defaults.update(getattr(base, "_defaults", {}))
+        cls._defaults.update(defaults)
+        return cls
+
+
+class CompactModel(metaclass=CompactMeta):
+    """the root of the models when HBNB_FILE_COMPACT is set
+
+    The attributes every model has are slots here, so an instance is a
+    fixed array of references with no __dict__ until an attribute that
+    is not a field is set on it.
+    """
+    __slots__ = ("__dict__", "__weakref__", "id", "created_at", "updated_at")
+
+    def __getattr__(self, name):
+        """returns the default of a field that is not set"""
+        try:
+            return self._defaults[name]
+        except KeyError:
+            raise AttributeError("'{}' object has no attribute '{}'".
+                                 format(self.__class__.__name__, name))
+
+    def _attribute(self, name):
+        """returns the value set on the instance for name, or None"""
+        slot = self._slots.get(name)
+        if slot is None:
+            return self.__dict__.get(name)
+        try:
+            return slot.__get__(self)
+        except AttributeError:
+            return None
+
+    def _attributes(self):
+        """returns a dictionary of the attributes set on the instance"""
+        attributes = {}
+        for name, slot in self._slots.items():
+            try:
+                attributes[name] = slot.__get__(self)
+            except AttributeError:
+                pass
+        attributes.update(self.__dict__)
+        return attributes
+
+    def _update(self, attributes):
+        """sets attributes on the instance, bypassing __setattr__"""
+        for name, value in attributes.items():
+            slot = self._slots.get(name)
+            if slot is None:
+                self.__dict__[name] = value
+            else:
+                slot.__set__(self, value)
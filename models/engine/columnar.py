@@ -0,0 +1,296 @@
+#!/usr/bin/python3
+"""
+Contains the class Columns, the numeric attributes of the places kept in
+contiguous typed arrays
+"""
+
+from array import array
+import math
+from models.engine.query import OPERATORS
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# tuple - the Place attributes kept in columns
+NUMERIC = ("number_rooms", "number_bathrooms", "max_guest", "price_by_night",
+           "latitude", "longitude")
+# tuple - the columns holding integers, the others hold floats
+INTEGERS = ("number_rooms", "number_bathrooms", "max_guest", "price_by_night")
+# tuple - the Place attributes the columns can be grouped and filtered by
+GROUPS = ("city_id", "user_id")
+# tuple - the operators a column evaluates, the others are left to matches()
+COLUMN_OPERATORS = ("eq", "ne", "lt", "lte", "gt", "gte", "in")
+# integer - past it a float does not hold every integer exactly
+EXACT = 2 ** 53
+
+
+def number(value):
+    """returns value as a float, or None if a column cannot hold it exactly
+
+    None is NaN in a column: as in matches(), every comparison with it
+    fails.
+    """
+    if value is None:
+        return math.nan
+    if isinstance(value, float) or (isinstance(value, int) and
+                                    abs(value) <= EXACT):
+        return float(value)
+    return None
+
+
+def summarize(pairs, integer=False):
+    """returns {group: {count, min, max, avg}} for (group, value) pairs
+
+    Pairs whose value is None or NaN are left out. min and max are
+    integers when integer is set and their value is whole.
+    """
+    stats = {}
+    for group, value in pairs:
+        if value is None or value != value:
+            continue
+        entry = stats.get(group)
+        if entry is None:
+            stats[group] = [1, value, value, value]
+        else:
+            entry[0] += 1
+            entry[1] = min(entry[1], value)
+            entry[2] = max(entry[2], value)
+            entry[3] += value
+    return {group: {"count": count,
+                    "min": whole(low) if integer else low,
+                    "max": whole(high) if integer else high,
+                    "avg": total / count}
+            for group, (count, low, high, total) in stats.items()}
+
+
+def whole(value):
+    """returns value as an int when it is a whole float"""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def aggregate(objs, attribute, by=None):
+    """returns the stats of attribute of objs grouped by the attribute by
+
+    Objects whose attribute is not a number, or whose by attribute is
+    None, are left out. Without by, all objects are one group, None.
+    """
+    pairs = []
+    for obj in objs:
+        group = None if by is None else getattr(obj, by, None)
+        value = number(getattr(obj, attribute, None))
+        if value is not None and (by is None or group is not None):
+            pairs.append((group, value))
+    return summarize(pairs, attribute in INTEGERS)
+
+
+class Columns:
+    """the numeric attributes of a set of places, one typed array each
+
+    Row i of every column holds the attributes of the place stored under
+    keys[i]; removing a row moves the last one into its place, so the
+    arrays stay contiguous. city_id and user_id are kept as integer codes.
+    A predicate is evaluated over whole columns, with NumPy when it is
+    installed and by a loop over the arrays otherwise, and gives the keys
+    of the places that may match: values a column cannot hold, such as a
+    string, are NaN in it and their rows always come out, so that the
+    caller checking the objects with matches() gets the exact answer.
+    """
+
+    def __init__(self):
+        """creates empty columns"""
+        self.keys = []
+        self.rows = {}
+        self.values = {attribute: array("d") for attribute in NUMERIC}
+        self.codes = {attribute: array("q") for attribute in GROUPS}
+        self.groups = {attribute: {} for attribute in GROUPS}
+        self.names = {attribute: [] for attribute in GROUPS}
+        self.odd = {attribute: set() for attribute in NUMERIC}
+
+    def __len__(self):
+        """returns the number of rows"""
+        return len(self.keys)
+
+    def __code(self, attribute, value):
+        """returns the code of value in the group column attribute"""
+        codes = self.groups[attribute]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self.names[attribute])
+            self.names[attribute].append(value)
+        return code
+
+    def set(self, key, obj):
+        """writes the attributes of obj, stored under key, to its row"""
+        row = self.rows.get(key)
+        if row is None:
+            row = self.rows[key] = len(self.keys)
+            self.keys.append(key)
+            for column in self.values.values():
+                column.append(math.nan)
+            for column in self.codes.values():
+                column.append(0)
+        for attribute, column in self.values.items():
+            value = number(getattr(obj, attribute, None))
+            if value is None:
+                self.odd[attribute].add(key)
+                value = math.nan
+            else:
+                self.odd[attribute].discard(key)
+            column[row] = value
+        for attribute, column in self.codes.items():
+            column[row] = self.__code(attribute,
+                                      getattr(obj, attribute, None))
+
+    def remove(self, key):
+        """removes the row of key, if any"""
+        row = self.rows.pop(key, None)
+        if row is None:
+            return
+        last = self.keys.pop()
+        for column in list(self.values.values()) + list(self.codes.values()):
+            value = column.pop()
+            if row < len(column):
+                column[row] = value
+        if last != key:
+            self.keys[row] = last
+            self.rows[last] = row
+        for keys in self.odd.values():
+            keys.discard(key)
+
+    def predicates(self, filters):
+        """returns the (attribute, op, value) of filters a column evaluates
+
+        Values are made floats, or codes for the group columns.
+        """
+        predicates = []
+        for attribute, op, value in filters:
+            if op not in COLUMN_OPERATORS:
+                continue
+            values = value if op == "in" else [value]
+            if op == "in" and not isinstance(value, (list, tuple, set)):
+                continue
+            if attribute in self.values:
+                values = [number(v) for v in values]
+                if any(v is None or v != v for v in values):
+                    continue
+            elif attribute in self.codes and op in ("eq", "in"):
+                if not all(v is None or isinstance(v, str) for v in values):
+                    continue
+                values = [self.groups[attribute].get(v, -1) for v in values]
+            else:
+                continue
+            predicates.append((attribute, op,
+                               values if op == "in" else values[0]))
+        return predicates
+
+    def select(self, filters):
+        """returns the keys of the rows that may match filters
+
+        Returns None when no filter can be evaluated on the columns.
+        """
+        predicates = self.predicates(filters)
+        if not predicates:
+            return None
+        if not self.keys:
+            return []
+        if numpy is not None:
+            rows = self.__select_numpy(predicates)
+        else:
+            rows = self.__select_arrays(predicates)
+        keys = [self.keys[row] for row in rows]
+        odd = set()
+        for attribute, op, value in predicates:
+            odd.update(self.odd.get(attribute, ()))
+        if odd:
+            keys = list(set(keys) | odd)
+        return keys
+
+    def __column(self, attribute):
+        """returns the values or the codes of attribute"""
+        if attribute in self.values:
+            return self.values[attribute]
+        return self.codes[attribute]
+
+    def __select_numpy(self, predicates):
+        """returns the rows matching predicates, evaluated with NumPy"""
+        mask = None
+        for attribute, op, value in predicates:
+            column = self.__column(attribute)
+            if attribute in self.values:
+                column = numpy.frombuffer(column, dtype=numpy.float64)
+            else:
+                column = numpy.frombuffer(column, dtype=numpy.int64)
+            if op == "in":
+                hits = numpy.isin(column, value)
+            else:
+                hits = OPERATORS[op](column, value)
+                if op == "ne":
+                    # NaN differs from every value, but stands for None
+                    hits &= column == column
+            mask = hits if mask is None else mask & hits
+        return numpy.flatnonzero(mask).tolist()
+
+    def __select_arrays(self, predicates):
+        """returns the rows matching predicates, evaluated by a loop"""
+        rows = range(len(self.keys))
+        for attribute, op, value in predicates:
+            column = self.__column(attribute)
+            if op == "in":
+                value = set(value)
+                rows = [row for row in rows if column[row] in value]
+            elif op == "ne":
+                rows = [row for row in rows
+                        if column[row] != value and column[row] == column[row]]
+            else:
+                test = OPERATORS[op]
+                rows = [row for row in rows if test(column[row], value)]
+        return rows
+
+    def aggregate(self, attribute, by=None):
+        """returns the stats of the column attribute grouped by the column by
+
+        As aggregate() does for objects, rows whose value is not a number
+        or whose group is None are left out.
+        """
+        column = self.values[attribute]
+        integer = attribute in INTEGERS
+        if numpy is None or not self.keys:
+            if by is None:
+                return summarize(((None, value) for value in column),
+                                 integer)
+            names = self.names[by]
+            return summarize(((names[code], value) for code, value
+                              in zip(self.codes[by], column)
+                              if names[code] is not None), integer)
+        values = numpy.frombuffer(column, dtype=numpy.float64)
+        valid = values == values
+        values = values[valid]
+        if by is None:
+            names = [None]
+            codes = numpy.zeros(len(values), dtype=numpy.int64)
+        else:
+            names = self.names[by]
+            codes = numpy.frombuffer(self.codes[by], dtype=numpy.int64)
+            codes = codes[valid]
+        size = len(names)
+        counts = numpy.bincount(codes, minlength=size)
+        totals = numpy.bincount(codes, weights=values, minlength=size)
+        lows = numpy.full(size, math.inf)
+        numpy.minimum.at(lows, codes, values)
+        highs = numpy.full(size, -math.inf)
+        numpy.maximum.at(highs, codes, values)
+        stats = {}
+        for code in numpy.flatnonzero(counts).tolist():
+            if by is not None and names[code] is None:
+                continue
+            low, high = float(lows[code]), float(highs[code])
+            stats[names[code]] = {"count": int(counts[code]),
+                                  "min": whole(low) if integer else low,
+                                  "max": whole(high) if integer else high,
+                                  "avg": float(totals[code]) /
+                                  int(counts[code])}
+        return stats
@@ -0,0 +1,41 @@
+#!/usr/bin/python3
+"""
+Contains the cursors of the keyset pagination of the storage engines
+"""
+
+import base64
+from datetime import datetime
+import json
+
+
+def sort_value(obj, attribute):
+    """returns the value of attribute of obj as it is stored in a cursor"""
+    value = getattr(obj, attribute, None)
+    if isinstance(value, datetime):
+        return value.isoformat(timespec="microseconds")
+    return value
+
+
+def sort_key(value, id):
+    """returns the key ordering objects by value, then id, None first"""
+    return (value is not None, value, id)
+
+
+def encode_cursor(obj, attribute):
+    """returns the cursor of the page starting after obj"""
+    data = json.dumps([sort_value(obj, attribute), obj.id])
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """returns the sort value and the id held by cursor
+
+    Raises ValueError when cursor was not made by encode_cursor().
+    """
+    try:
+        value, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError("invalid cursor")
+    if not isinstance(id, str):
+        raise ValueError("invalid cursor")
+    return value, id
@@ -7,23 +7,225 @@ import models
 from models.amenity import Amenity
 from models.base_model import BaseModel, Base
 from models.city import City
+from models.engine.cursor import decode_cursor, encode_cursor
+from models.engine.geo import bounds, within
+from models.engine.query import OPERATORS, Query
 from models.place import Place
 from models.review import Review
 from models.state import State
 from models.user import User
+from datetime import datetime
+from itertools import count, islice
 from os import getenv
 import sqlalchemy
-from sqlalchemy import create_engine, MetaData
-from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy import and_, create_engine, DateTime, event, func
+from sqlalchemy import MetaData, or_, select
+from sqlalchemy.orm import make_transient_to_detached, scoped_session
+from sqlalchemy.orm import selectinload, Session, sessionmaker
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.pool import QueuePool, StaticPool
+from sqlalchemy.sql.expression import Select
+import threading
+import time
 
 classes = {"Amenity": Amenity, "City": City,
            "Place": Place, "Review": Review, "State": State, "User": User}
 
 
+def class_of(cls):
+    """returns the mapped class for cls, which may be a class or its name"""
+    if isinstance(cls, str):
+        return classes.get(cls)
+    return cls
+
+
+def load_options(cls, load):
+    """returns the query options eagerly loading the relationships in load
+
+    Each entry names a relationship of cls, or a dotted path of them such
+    as "cities.places"; every step is loaded with one SELECT ... IN query.
+    """
+    options = []
+    for path in load or ():
+        option = None
+        owner = cls
+        for name in path.split("."):
+            attribute = getattr(owner, name)
+            if option is None:
+                option = selectinload(attribute)
+            else:
+                option = option.selectinload(attribute)
+            owner = attribute.property.mapper.class_
+        options.append(option)
+    return options
+
+
+def column_values(obj):
+    """returns the mapped column values of obj by attribute name"""
+    mapper = sqlalchemy.inspect(obj).mapper
+    return {attr.key: getattr(obj, attr.key) for attr in mapper.column_attrs}
+
+
+def batches(objs, size):
+    """yields the objects of objs in lists of size, grouped by class"""
+    objs = iter(objs)
+    while True:
+        batch = list(islice(objs, size))
+        if not batch:
+            return
+        by_class = {}
+        for obj in batch:
+            by_class.setdefault(obj.__class__, []).append(obj)
+        yield by_class
+
+
+def db_engine(url, pool, pragmas):
+    """returns an engine for url with the pool settings in pool
+
+    SQLite connections are shared between threads and run the PRAGMA
+    statements in pragmas when opened. An in-memory SQLite database only
+    exists on its connection, so a single one is kept for it.
+    """
+    url = sqlalchemy.engine.make_url(url)
+    if url.get_backend_name() != "sqlite":
+        return create_engine(url, **pool)
+    if url.database in (None, "", ":memory:"):
+        pool = {"poolclass": StaticPool}
+    engine = create_engine(url, connect_args={"check_same_thread": False},
+                           **pool)
+
+    def on_connect(dbapi_connection, connection_record):
+        """sets the pragmas on a new connection"""
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute("PRAGMA {}={}".format(name, value))
+        cursor.close()
+    event.listen(engine, "connect", on_connect)
+    return engine
+
+
+class TimedQueuePool(QueuePool):
+    """a QueuePool that records how long checkouts wait for a connection
+
+    checkouts counts every checkout. waits counts those that found every
+    connection in use and no room to open another; wait_time and max_wait
+    are the total and the longest of their waits, in seconds.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """creates the pool with empty wait statistics"""
+        super().__init__(*args, **kwargs)
+        self.__stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def _do_get(self):
+        """checks a connection out, timing the wait if there is one"""
+        full = (self.checkedin() == 0 and self._max_overflow > -1 and
+                self.overflow() >= self._max_overflow)
+        start = time.monotonic()
+        try:
+            return super()._do_get()
+        finally:
+            wait = time.monotonic() - start
+            with self.__stats_lock:
+                self.checkouts += 1
+                if full:
+                    self.waits += 1
+                    self.wait_time += wait
+                    self.max_wait = max(self.max_wait, wait)
+
+
+class ReplicaSet:
+    """the read replicas, handed out in turn while they are up
+
+    A replica whose connection fails is left out for cooldown seconds,
+    after which it is tried again.
+    """
+
+    def __init__(self, engines, cooldown):
+        """creates the set of the replica engines"""
+        self.engines = engines
+        self.__cooldown = cooldown
+        self.__turn = count()
+        self.__down = {}
+        for engine in engines:
+            event.listen(engine, "handle_error", self.__handle_error)
+
+    def choose(self):
+        """returns the next replica that is up, or None if none is"""
+        now = time.monotonic()
+        for i in range(len(self.engines)):
+            engine = self.engines[next(self.__turn) % len(self.engines)]
+            if self.__down.get(engine, 0) <= now:
+                return engine
+        return None
+
+    def mark_down(self, engine):
+        """leaves engine out until the cooldown has passed"""
+        self.__down[engine] = time.monotonic() + self.__cooldown
+
+    def __handle_error(self, context):
+        """marks a replica down when its connection fails"""
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(context.engine)
+
+
+class RoutingSession(Session):
+    """a session reading from a replica until it writes
+
+    Queries go to the replica chosen for the session; once the session
+    flushes or runs any other statement, everything, reads included, goes
+    to the primary until the session is closed. A query whose replica
+    fails is run again on the primary.
+    """
+
+    def __init__(self, replicas=None, **kwargs):
+        """creates a session reading from one of replicas, if any"""
+        super().__init__(**kwargs)
+        self.replicas = replicas
+        self.replica = None
+        self.on_primary = replicas is None
+        event.listen(self, "before_flush", self.__before_flush)
+
+    def __before_flush(self, session, flush_context, instances):
+        """keeps the session on the primary from its first flush"""
+        self.on_primary = True
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        """returns the engine to run clause on"""
+        if not self.on_primary:
+            if not isinstance(clause, Select):
+                self.on_primary = True
+            else:
+                if self.replica is None:
+                    self.replica = self.replicas.choose()
+                if self.replica is not None:
+                    return self.replica
+        return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+
+    def execute(self, statement, *args, **kwargs):
+        """runs statement, on the primary if its replica fails"""
+        try:
+            return super().execute(statement, *args, **kwargs)
+        except sqlalchemy.exc.OperationalError:
+            if (self.on_primary or self.replica is None or
+                    self.new or self.dirty or self.deleted):
+                raise
+            self.replicas.mark_down(self.replica)
+            # the session has only read so far, nothing is lost
+            self.rollback()
+            self.on_primary = True
+            return super().execute(statement, *args, **kwargs)
+
+
 class DBStorage:
     """interaacts with the MySQL database"""
     __engine = None
     __session = None
+    __replicas = None
 
     def __init__(self):
         """Instantiate a DBStorage object"""
@@ -32,25 +234,85 @@ class DBStorage:
         HBNB_MYSQL_HOST = getenv('HBNB_MYSQL_HOST')
         HBNB_MYSQL_DB = getenv('HBNB_MYSQL_DB')
         HBNB_ENV = getenv('HBNB_ENV')
-        self.__engine = create_engine('mysql+mysqldb://{}:{}@{}/{}'.
-                                      format(HBNB_MYSQL_USER,
-                                             HBNB_MYSQL_PWD,
-                                             HBNB_MYSQL_HOST,
-                                             HBNB_MYSQL_DB))
+        HBNB_MYSQL_POOL_SIZE = int(getenv('HBNB_MYSQL_POOL_SIZE', 5))
+        HBNB_MYSQL_MAX_OVERFLOW = int(getenv('HBNB_MYSQL_MAX_OVERFLOW', 10))
+        HBNB_MYSQL_POOL_TIMEOUT = float(getenv('HBNB_MYSQL_POOL_TIMEOUT', 30))
+        HBNB_MYSQL_POOL_RECYCLE = int(getenv('HBNB_MYSQL_POOL_RECYCLE', 3600))
+        HBNB_MYSQL_POOL_PRE_PING = getenv('HBNB_MYSQL_POOL_PRE_PING', '1').\
+            lower() not in ('0', 'false', 'no', 'off')
+        mysql_url = 'mysql+mysqldb://{}:{}@{}/{}'
+        HBNB_DB_URL = getenv('HBNB_DB_URL', mysql_url.format(HBNB_MYSQL_USER,
+                                                             HBNB_MYSQL_PWD,
+                                                             HBNB_MYSQL_HOST,
+                                                             HBNB_MYSQL_DB))
+        HBNB_DB_REPLICAS = getenv('HBNB_DB_REPLICAS', '')
+        HBNB_DB_REPLICA_COOLDOWN = float(getenv('HBNB_DB_REPLICA_COOLDOWN',
+                                                30))
+        HBNB_SQLITE_SYNCHRONOUS = getenv('HBNB_SQLITE_SYNCHRONOUS', 'NORMAL')
+        HBNB_SQLITE_MMAP_SIZE = int(getenv('HBNB_SQLITE_MMAP_SIZE',
+                                           256 * 1024 * 1024))
+        pool = {"poolclass": TimedQueuePool,
+                "pool_size": HBNB_MYSQL_POOL_SIZE,
+                "max_overflow": HBNB_MYSQL_MAX_OVERFLOW,
+                "pool_timeout": HBNB_MYSQL_POOL_TIMEOUT,
+                "pool_recycle": HBNB_MYSQL_POOL_RECYCLE,
+                "pool_pre_ping": HBNB_MYSQL_POOL_PRE_PING}
+        # used with SQLite URLs only: write-ahead logging lets readers run
+        # alongside the writer, and NORMAL only syncs at checkpoints
+        pragmas = {"journal_mode": "WAL",
+                   "synchronous": HBNB_SQLITE_SYNCHRONOUS,
+                   "mmap_size": HBNB_SQLITE_MMAP_SIZE,
+                   "foreign_keys": "ON"}
+        self.__engine = db_engine(HBNB_DB_URL, pool, pragmas)
+        replicas = []
+        # replicas are URLs, or MySQL hosts sharing the primary's settings
+        for url in HBNB_DB_REPLICAS.split(','):
+            url = url.strip()
+            if url and '://' not in url:
+                url = mysql_url.format(HBNB_MYSQL_USER, HBNB_MYSQL_PWD, url,
+                                       HBNB_MYSQL_DB)
+            if url:
+                replicas.append(db_engine(url, pool, pragmas))
+        if replicas:
+            self.__replicas = ReplicaSet(replicas, HBNB_DB_REPLICA_COOLDOWN)
         if HBNB_ENV == "test":
             Base.metadata.drop_all(self.__engine)
 
-    def all(self, cls=None):
-        """query on the current database session"""
+    def all(self, cls=None, load=None):
+        """query on the current database session
+
+        load lists relationships of cls to load with the objects, in one
+        query per relationship instead of one per object; a ValueError is
+        raised if it is given without cls.
+        """
+        if load and cls is None:
+            raise ValueError("load needs the class it applies to")
         new_dict = {}
         for clss in classes:
-            if cls is None or cls is classes[clss] or cls is clss:
-                objs = self.__session.query(classes[clss]).all()
+            if cls is None or cls is classes[clss] or cls == clss:
+                query = self.__session.query(classes[clss])
+                query = query.options(*load_options(classes[clss], load))
+                objs = query.all()
                 for obj in objs:
                     key = obj.__class__.__name__ + '.' + obj.id
                     new_dict[key] = obj
         return (new_dict)
 
+    def iter(self, cls=None, batch_size=1000, load=None):
+        """yields the objects, or those of class cls, one at a time
+
+        Rows are read through a server-side cursor batch_size at a time,
+        so only one batch is held in memory at once. load is as in all().
+        """
+        if load and cls is None:
+            raise ValueError("load needs the class it applies to")
+        for clss in classes:
+            if cls is None or cls is classes[clss] or cls == clss:
+                query = self.__session.query(classes[clss])
+                query = query.options(*load_options(classes[clss], load))
+                for obj in query.yield_per(batch_size):
+                    yield obj
+
     def new(self, obj):
         """add the object to the current database session"""
         self.__session.add(obj)
@@ -64,43 +326,252 @@ class DBStorage:
         if obj is not None:
             self.__session.delete(obj)
 
+    def bulk_new(self, objs, batch_size=1000):
+        """inserts every object of objs, batch_size rows per statement
+
+        The rows are written with executemany and committed once; the
+        objects are then attached to the session as if loaded from it.
+        Relationship collections, such as Place.amenities, are not saved.
+        """
+        inserted = []
+        for by_class in batches(objs, batch_size):
+            for cls, group in by_class.items():
+                for obj in group:
+                    if obj in self.__session:
+                        self.__session.expunge(obj)
+                self.__session.bulk_insert_mappings(
+                    cls, [column_values(obj) for obj in group])
+                inserted.extend(group)
+        self.__session.commit()
+        for obj in inserted:
+            make_transient_to_detached(obj)
+            self.__session.add(obj)
+
+    def bulk_update(self, objs, batch_size=1000):
+        """stamps updated_at on every object of objs and saves them
+
+        Like BaseModel.save() for each object, but the rows are updated
+        with executemany, batch_size rows per statement, and committed
+        once.
+        """
+        now = datetime.utcnow()
+        for by_class in batches(objs, batch_size):
+            for cls, group in by_class.items():
+                mappings = []
+                for obj in group:
+                    obj.updated_at = now
+                    values = column_values(obj)
+                    # the session has nothing left to flush for obj
+                    for key, value in values.items():
+                        set_committed_value(obj, key, value)
+                    mappings.append(values)
+                self.__session.bulk_update_mappings(cls, mappings)
+        self.__session.commit()
+
+    def bulk_delete(self, objs, batch_size=1000):
+        """deletes every object of objs, batch_size rows per statement"""
+        for by_class in batches(objs, batch_size):
+            for cls, group in by_class.items():
+                ids = [obj.id for obj in group]
+                self.__session.query(cls).filter(cls.id.in_(ids)).\
+                    delete(synchronize_session=False)
+                for obj in group:
+                    if obj in self.__session:
+                        self.__session.expunge(obj)
+        self.__session.commit()
+
     def reload(self):
         """reloads data from the database"""
         Base.metadata.create_all(self.__engine)
-        sess_factory = sessionmaker(bind=self.__engine, expire_on_commit=False)
+        self.migrate()
+        sess_factory = sessionmaker(bind=self.__engine, expire_on_commit=False,
+                                    class_=RoutingSession,
+                                    replicas=self.__replicas)
         Session = scoped_session(sess_factory)
         self.__session = Session
 
+    def migrate(self):
+        """adds the indexes declared on the models to existing tables
+
+        create_all() only creates missing tables, so indexes declared after
+        a table was created are added here. An index is skipped when its
+        name exists or its columns already lead another index, such as the
+        one MySQL creates for a foreign key, so this runs on every reload.
+        """
+        inspector = sqlalchemy.inspect(self.__engine)
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = inspector.get_indexes(table.name)
+            for index in table.indexes:
+                columns = [column.name for column in index.columns]
+                if any(found["name"] == index.name or
+                       found["column_names"][:len(columns)] == columns
+                       for found in existing):
+                    continue
+                try:
+                    index.create(self.__engine)
+                except sqlalchemy.exc.DBAPIError:
+                    # another process may have added it in the meantime
+                    names = [found["name"] for found in
+                             sqlalchemy.inspect(self.__engine).
+                             get_indexes(table.name)]
+                    if index.name not in names:
+                        raise
+
     def close(self):
         """call remove() method on the private session attribute"""
         self.__session.remove()
 
+    def pool_stats(self):
+        """returns the state of the connection pool and its checkout waits
+
+        checkouts is the number of checkouts so far and waits the number
+        of them that had to wait for a connection to be returned;
+        wait_time is the total in seconds those waited, max_wait the
+        longest.
+        """
+        pool = self.__engine.pool
+        if not isinstance(pool, QueuePool):
+            return {}
+        return {"size": pool.size(), "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+                "checkouts": getattr(pool, "checkouts", 0),
+                "waits": getattr(pool, "waits", 0),
+                "wait_time": getattr(pool, "wait_time", 0.0),
+                "max_wait": getattr(pool, "max_wait", 0.0)}
+
     def get(self, cls, id):
         '''
             Retrieve an obj w/class name and id
         '''
-        result = None
-        try:
-            objs = self.__session.query(models.classes[cls]).all()
-            for obj in objs:
-                if obj.id == id:
-                    result = obj
-        except BaseException:
-            pass
-        return result
+        cls = class_of(cls)
+        if cls is None or id is None:
+            return None
+        return self.__session.get(cls, id)
+
+    def page(self, cls, after=None, limit=100, order_by="id", **filters):
+        '''
+            Return up to limit objects of cls past the cursor after,
+            ordered by order_by then id, and the cursor of the next page
+        '''
+        cls = class_of(cls)
+        column = getattr(cls, order_by)
+        query = self.__session.query(cls).filter_by(**filters)
+        if after is not None:
+            value, id = decode_cursor(after)
+            if order_by == "id":
+                query = query.filter(cls.id > id)
+            elif value is None:
+                query = query.filter(or_(column.isnot(None),
+                                         cls.id > id))
+            else:
+                if isinstance(column.type, DateTime):
+                    value = datetime.fromisoformat(value)
+                query = query.filter(or_(column > value,
+                                         and_(column == value, cls.id > id)))
+        if order_by != "id":
+            query = query.order_by(column)
+        objs = query.order_by(cls.id).limit(limit + 1).all()
+        if len(objs) > limit:
+            return objs[:limit], encode_cursor(objs[limit - 1], order_by)
+        return objs, None
+
+    def query(self, cls):
+        '''
+            Return a Query on the objects of cls
+        '''
+        return Query(self, class_of(cls))
+
+    def run(self, query, count=False):
+        '''
+            Run query as SQL and return its objects, or their number if
+            count is set
+        '''
+        cls = class_of(query.cls)
+        result = self.__session.query(cls)
+        for attribute, op, value in query.filters:
+            column = getattr(cls, attribute)
+            if op == "in":
+                result = result.filter(column.in_(value))
+            elif op == "contains" and isinstance(value, str):
+                # lower() on both sides ignores case whatever the collation
+                result = result.filter(func.lower(column).contains(
+                    value.lower(), autoescape=True))
+            elif op == "contains":
+                result = result.filter(sqlalchemy.false())
+            else:
+                result = result.filter(OPERATORS[op](column, value))
+        for attribute, descending in query.ordering:
+            column = getattr(cls, attribute)
+            result = result.order_by(column.desc() if descending else column)
+        result = result.order_by(cls.id).offset(query.offset_count or None)
+        result = result.limit(query.limit_count)
+        return result.count() if count else result.all()
+
+    def aggregate(self, cls, attribute, by=None):
+        '''
+            Return {group: {"count", "min", "max", "avg"}} for the numeric
+            attribute of the objects of cls, grouped by their attribute by
+            or all in group None, in a single query
+        '''
+        cls = class_of(cls)
+        column = getattr(cls, attribute)
+        stats = [func.count(column), func.min(column), func.max(column),
+                 func.avg(column)]
+        if by is None:
+            rows = [(None,) + tuple(self.__session.execute(
+                select(*stats).where(column.isnot(None))).one())]
+        else:
+            group = getattr(cls, by)
+            rows = self.__session.execute(
+                select(group, *stats)
+                .where(column.isnot(None), group.isnot(None))
+                .group_by(group)).all()
+        return {group: {"count": count, "min": low, "max": high,
+                        "avg": float(avg)}
+                for group, count, low, high, avg in rows if count}
+
+    def nearby(self, latitude, longitude, radius, limit=None):
+        '''
+            Return (distance, place) for the places within radius km of
+            a point, nearest first and at most limit. The box around the
+            circle is searched through the latitude index, then the
+            distances are measured on the coordinates it returns
+        '''
+        lat_min, lat_max, lng_ranges = bounds(latitude, longitude, radius)
+        query = (select(Place.id, Place.latitude, Place.longitude)
+                 .where(Place.latitude.between(lat_min, lat_max),
+                        or_(*[Place.longitude.between(low, high)
+                              for low, high in lng_ranges])))
+        hits = within(self.__session.execute(query).all(), latitude,
+                      longitude, radius, limit)
+        ids = [id for km, id in hits]
+        places = {}
+        for start in range(0, len(ids), 1000):
+            places.update((place.id, place) for place in
+                          self.__session.query(Place).filter(
+                              Place.id.in_(ids[start:start + 1000])))
+        return [(km, places[id]) for km, id in hits if id in places]
 
     def count(self, cls=None):
         '''
             Count num objects in DBstorage
         '''
-        cls_counter = 0
+        if cls is None:
+            return sum(self.counts().values())
+        cls = class_of(cls)
+        if cls is None:
+            return 0
+        query = select(func.count()).select_from(cls)
+        return self.__session.execute(query).scalar()
 
-        if cls is not None:
-            objs = self.__session.query(models.classes[cls]).all()
-            cls_counter = len(objs)
-        else:
-            for k, v in models.classes.items():
-                if k != "BaseModel":
-                    objs = self.__session.query(models.classes[k]).all()
-                    cls_counter += len(objs)
-        return cls_counter
+    def counts(self):
+        '''
+            Count the objects of every class in a single query
+        '''
+        query = select(*[select(func.count()).select_from(classes[name])
+                         .scalar_subquery().label(name)
+                         for name in classes])
+        return dict(self.__session.execute(query).one()._mapping)
@@ -3,67 +3,1099 @@
 Contains the FileStorage class
 """
 
+import bisect
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
 import json
+from json.decoder import scanstring
 from models.amenity import Amenity
-from models.base_model import BaseModel
+from models.base_model import BaseModel, serializer, to_dicts
 from models.city import City
+from models.engine.columnar import aggregate, Columns, GROUPS, NUMERIC
+from models.engine.cursor import (decode_cursor, encode_cursor, sort_key,
+                                  sort_value)
+from models.engine.geo import GridIndex, position, within
+from models.engine.query import matches, order_key, Query
 from models.place import Place
 from models.review import Review
 from models.state import State
 from models.user import User
+import hashlib
+import mmap
+import multiprocessing
+import os
+import tempfile
+import threading
+import weakref
+import zlib
 
 classes = {"Amenity": Amenity, "BaseModel": BaseModel, "City": City,
            "Place": Place, "Review": Review, "State": State, "User": User}
 
 
+def class_name(cls):
+    """returns the name of cls, which may be a class or a class name"""
+    if isinstance(cls, str):
+        return cls
+    return cls.__name__
+
+
+# tuple - attributes holding the id of a parent object, indexed so that
+# the objects referring to a parent are found without a scan
+FOREIGN_KEYS = ("state_id", "city_id", "place_id", "user_id")
+
+# dictionary - the class and foreign key of the objects behind each
+# relationship property, by class name and property name. Amenities have
+# no foreign key: a place lists their ids in amenity_ids
+RELATIONSHIPS = {("State", "cities"): ("City", "state_id"),
+                 ("City", "places"): ("Place", "city_id"),
+                 ("Place", "reviews"): ("Review", "place_id"),
+                 ("Place", "amenities"): ("Amenity", None),
+                 ("User", "places"): ("Place", "user_id"),
+                 ("User", "reviews"): ("Review", "user_id")}
+
+# string - starts the optional last line of the JSON file holding the
+# SHA-256 of everything before it
+CHECKSUM_PREFIX = "\n#sha256:"
+
+
+def env_flag(name):
+    """returns True if the environment variable name is set to a yes value"""
+    return os.getenv(name, "").lower() in ("1", "true", "yes", "on")
+
+
+def write_atomic(path, data):
+    """replaces the file at path with data so readers see all of it or none
+
+    data goes to a temporary file in the same directory, is fsynced and
+    then renamed over path, which is atomic on POSIX and Windows.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp",
+                                    prefix=os.path.basename(path) + ".")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def file_stamp(path):
+    """returns what identifies the current version of the file at path"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def journal_stamp(stamp, offset):
+    """returns the stamp of a journal that was read up to offset
+
+    A journal whose last line was incomplete is only read up to offset,
+    and the stamp then keeps its size at offset so that the next reload
+    goes back for the rest of it.
+    """
+    if stamp is None or stamp[1] == offset:
+        return stamp
+    return (stamp[0], offset, None)
+
+
+def format_snapshot(texts):
+    """returns the JSON file content for a {key: record JSON text} dict
+
+    Each record goes on a line of its own, so the result is still one
+    JSON object but can be split back into records without parsing them.
+    """
+    if not texts:
+        return "{}"
+    lines = [json.dumps(key) + ": " + text for key, text in texts.items()]
+    return "{\n" + ",\n".join(lines) + "\n}"
+
+
+def parse_snapshot(data):
+    """returns {key: record JSON text} for the content of a JSON file"""
+    if data.startswith("{\n") and data.endswith("\n}"):
+        texts = {}
+        try:
+            for line in data[2:-2].split("\n"):
+                if line.endswith(","):
+                    line = line[:-1]
+                key, end = scanstring(line, 1)
+                if line[0] != '"' or line[end:end + 2] != ": ":
+                    raise ValueError("not a record line")
+                texts[key] = line[end + 2:]
+            return texts
+        except (ValueError, IndexError):
+            pass
+    # a file written in one piece by json.dump
+    return {key: json.dumps(value)
+            for key, value in json.loads(data).items()}
+
+
+def read_snapshot(path):
+    """returns {key: record JSON text} for the JSON file at path
+
+    A missing file is an empty store. A file whose checksum footer does
+    not match its contents, or that is not valid JSON, raises ValueError.
+    """
+    try:
+        with open(path, 'r') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return {}
+    index = data.rfind(CHECKSUM_PREFIX)
+    if index != -1:
+        digest = data[index + len(CHECKSUM_PREFIX):].strip()
+        data = data[:index]
+        if hashlib.sha256(data.encode()).hexdigest() != digest:
+            raise ValueError("{}: checksum mismatch".format(path))
+    try:
+        return parse_snapshot(data)
+    except ValueError as e:
+        raise ValueError("{}: {}".format(path, e))
+
+
+def checksummed(data):
+    """returns data followed by its checksum footer"""
+    digest = hashlib.sha256(data.encode()).hexdigest()
+    return data + CHECKSUM_PREFIX + digest + "\n"
+
+
+def partition_name(key, shards):
+    """returns the name of the partition file holding the record of key
+
+    Records are partitioned by class and, for more than one shard, by a
+    hash of their id that stays the same from one process to the next.
+    """
+    name, id = key.split(".", 1)
+    if shards <= 1:
+        return name + ".json"
+    return "{}.{}.json".format(name, zlib.crc32(id.encode()) % shards)
+
+
+def record_digest(text):
+    """returns a digest of a record JSON text, str or UTF-8 bytes
+
+    Unlike hash(), it is the same in every process, so that digests
+    computed by the decoding workers compare equal to this one's.
+    """
+    if isinstance(text, str):
+        text = text.encode()
+    return hashlib.blake2b(text, digest_size=8).digest()
+
+
+def decode_partition(path):
+    """returns {key: (digest of record JSON text, record)} for a partition"""
+    texts = read_snapshot(path)
+    return {key: (record_digest(text), json.loads(text))
+            for key, text in texts.items()}
+
+
+def decode_partitions(paths, workers):
+    """returns {path: decode_partition(path)} for each of paths
+
+    Partitions are decoded by up to workers processes when there is more
+    than a megabyte of them. The processes are forked, which is only
+    done while this process runs a single thread, as when the storage
+    is loaded at startup: a fork does not copy the other threads, and
+    the locks they hold would stay held in the children. Otherwise, or
+    where fork is not available, they are decoded one after the other.
+    """
+    size = 0
+    for path in paths:
+        try:
+            size += os.path.getsize(path)
+        except OSError:
+            pass
+    if (workers > 1 and len(paths) > 1 and size > 1024 * 1024 and
+            threading.active_count() == 1 and
+            "fork" in multiprocessing.get_all_start_methods()):
+        context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(min(workers, len(paths)),
+                                 mp_context=context) as pool:
+            return dict(zip(paths, pool.map(decode_partition, paths)))
+    return {path: decode_partition(path) for path in paths}
+
+
+class ReadWriteLock:
+    """a lock held either by any number of readers or by a single writer
+
+    Both sides are reentrant and the writer may also read. Writers
+    waiting for the lock keep new readers out so they are not starved.
+    A thread holding the read side cannot take the write side.
+    """
+
+    def __init__(self):
+        """creates an unlocked lock"""
+        self.__cond = threading.Condition(threading.Lock())
+        self.__readers = 0
+        self.__writer = None
+        self.__writes = 0
+        self.__waiting = 0
+        self.__local = threading.local()
+
+    @contextmanager
+    def reading(self):
+        """holds the read side of the lock for the body of a with block"""
+        depth = getattr(self.__local, "reads", 0)
+        if depth or self.__writer == threading.get_ident():
+            self.__local.reads = depth + 1
+            try:
+                yield
+            finally:
+                self.__local.reads = depth
+            return
+        with self.__cond:
+            while self.__writer is not None or self.__waiting:
+                self.__cond.wait()
+            self.__readers += 1
+        self.__local.reads = 1
+        try:
+            yield
+        finally:
+            self.__local.reads = 0
+            with self.__cond:
+                self.__readers -= 1
+                if not self.__readers:
+                    self.__cond.notify_all()
+
+    @contextmanager
+    def writing(self):
+        """holds the write side of the lock for the body of a with block"""
+        me = threading.get_ident()
+        with self.__cond:
+            if self.__writer == me:
+                self.__writes += 1
+            else:
+                if getattr(self.__local, "reads", 0):
+                    raise RuntimeError("cannot write while reading")
+                self.__waiting += 1
+                while self.__writer is not None or self.__readers:
+                    self.__cond.wait()
+                self.__waiting -= 1
+                self.__writer = me
+                self.__writes = 1
+        try:
+            yield
+        finally:
+            with self.__cond:
+                self.__writes -= 1
+                if not self.__writes:
+                    self.__writer = None
+                    self.__cond.notify_all()
+
+
+class GroupCommit:
+    """coalesces concurrent flush requests into shared durable writes"""
+
+    def __init__(self, interval=0):
+        """interval - seconds a flush waits for more callers to join it"""
+        self.interval = interval
+        self.__cond = threading.Condition()
+        self.__requested = 0
+        self.__done = 0
+        self.__flushing = False
+
+    def run(self, flush):
+        """returns once a call to flush() started after this call completed
+
+        The first caller runs flush() on behalf of everyone queued behind
+        it; callers arriving while it runs wait for the next flush, which
+        one of them runs once the current one is done.
+        """
+        with self.__cond:
+            self.__requested += 1
+            ticket = self.__requested
+            while self.__done < ticket:
+                if self.__flushing:
+                    self.__cond.wait()
+                    continue
+                self.__flushing = True
+                try:
+                    if self.interval > 0:
+                        self.__cond.wait(self.interval)
+                    covered = self.__requested
+                    self.__cond.release()
+                    try:
+                        flush()
+                    finally:
+                        self.__cond.acquire()
+                    self.__done = max(self.__done, covered)
+                finally:
+                    self.__flushing = False
+                    self.__cond.notify_all()
+
+
+def snapshot_offsets(texts):
+    """returns {key: (start, end)} of each record in format_snapshot(texts)
+
+    The offsets are byte positions of the record's JSON text in the file.
+    """
+    offsets = {}
+    position = 2
+    for key, text in texts.items():
+        start = position + len(json.dumps(key)) + 2
+        size = len(text) if text.isascii() else len(text.encode())
+        offsets[key] = (start, start + size)
+        position = start + size + 2
+    return offsets
+
+
+class LazyIndex:
+    """locates by key the records of a memory-mapped JSON file"""
+
+    def __init__(self):
+        """creates an index that maps no file"""
+        self.map = None
+        # dictionary - <class name>.id -> (start, end) of the record's JSON
+        # text in map
+        self.offsets = {}
+
+    def close(self):
+        """unmaps the file and forgets its records"""
+        if self.map is not None:
+            self.map.close()
+        self.map = None
+        self.offsets = {}
+
+    def open(self, path, offsets=None):
+        """maps the JSON file at path and returns {key: digest of record}
+
+        offsets, as returned by snapshot_offsets(), spares reading a file
+        that was just written; no hashes are returned then. Raises
+        ValueError for a file not written one record per line.
+        """
+        self.close()
+        try:
+            with open(path, 'rb') as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return {}
+        if offsets is not None:
+            self.offsets = offsets
+            return {}
+        mm = self.map
+        end = len(mm)
+        index = mm.rfind(CHECKSUM_PREFIX.encode())
+        if index != -1:
+            digest = mm[index + len(CHECKSUM_PREFIX):].decode().strip()
+            if hashlib.sha256(memoryview(mm)[:index]).hexdigest() != digest:
+                self.close()
+                raise ValueError("{}: checksum mismatch".format(path))
+            end = index
+        if mm[:end] == b"{}":
+            return {}
+        if mm[:2] != b"{\n" or mm[end - 2:end] != b"\n}":
+            self.close()
+            raise ValueError("{}: not one record per line".format(path))
+        hashes = {}
+        position = 2
+        end -= 2
+        try:
+            while position < end:
+                newline = mm.find(b"\n", position, end)
+                if newline == -1:
+                    newline = end
+                stop = newline - 1 if mm[newline - 1] == ord(",") else newline
+                head = mm[position:min(position + 256, stop)].decode()
+                try:
+                    key, key_end = scanstring(head, 1)
+                except ValueError:
+                    head = mm[position:stop].decode()
+                    key, key_end = scanstring(head, 1)
+                if head[0] != '"' or head[key_end:key_end + 2] != ": ":
+                    raise ValueError("not a record line")
+                start = position + len(head[:key_end + 2].encode())
+                self.offsets[key] = (start, stop)
+                hashes[key] = record_digest(mm[start:stop])
+                position = newline + 1
+        except (ValueError, IndexError):
+            self.close()
+            raise ValueError("{}: not one record per line".format(path))
+        return hashes
+
+    def text(self, key):
+        """returns the JSON text of the record stored under key"""
+        start, end = self.offsets[key]
+        return self.map[start:end].decode()
+
+
 class FileStorage:
     """serializes instances to a JSON file & deserializes back to instances"""
 
     # string - path to the JSON file
     __file_path = "file.json"
+    # string - path to the append-only journal of changes since the snapshot
+    __journal_path = __file_path + ".log"
+    # boolean - append changed records to the journal on save instead of
+    # rewriting the whole JSON file
+    __journal = env_flag("HBNB_FILE_JOURNAL")
+    # boolean - end the JSON file with a checksum that reload() verifies
+    __checksum = env_flag("HBNB_FILE_CHECKSUM")
+    # integer - journal size in bytes past which save() compacts it
+    __journal_max = int(os.getenv("HBNB_FILE_JOURNAL_MAX", 4 * 1024 * 1024))
+    # boolean - only build objects from their records in the JSON file once
+    # all(), get() or another lookup asks for them
+    __lazy = env_flag("HBNB_FILE_LAZY")
+    # string - "partitioned" keeps each class in JSON files of its own in
+    # __partition_dir, rewritten only when one of their records changed;
+    # "single" keeps everything in __file_path
+    __layout = os.getenv("HBNB_FILE_LAYOUT", "single")
+    # string - path to the directory of the partition files
+    __partition_dir = __file_path + ".d"
+    # integer - number of partition files each class is spread over
+    __shards = int(os.getenv("HBNB_FILE_SHARDS", 1))
+    # integer - most processes decoding partition files at once
+    __workers = int(os.getenv("HBNB_FILE_WORKERS", os.cpu_count() or 1))
+    # integer - most unmodified objects built lazily that stay in memory,
+    # the least recently used ones are dropped past it; 0 for no bound
+    __lazy_max = int(os.getenv("HBNB_FILE_LAZY_MAX", 0))
+    # GroupCommit - shares one durable write between concurrent save()
+    # calls, waiting HBNB_FILE_COMMIT_INTERVAL seconds for more to join
+    __group_commit = GroupCommit(
+        float(os.getenv("HBNB_FILE_COMMIT_INTERVAL", 0)))
+    # ReadWriteLock - held to read or to change the dictionaries below
+    __lock = ReadWriteLock()
+    # RLock - held while writing the JSON files and while reading them back
+    __io_lock = threading.RLock()
     # dictionary - empty but will store all objects by <class name>.id
     __objects = {}
+    # dictionary - <class name> -> {<class name>.id: obj}, the same objects
+    # as __objects bucketed per class for class-scoped lookups
+    __by_class = {}
+    # dictionary - (<class name>, foreign key) -> {parent id ->
+    # {<class name>.id: obj}} for the objects in __objects
+    __children = {}
+    # Columns - the numeric attributes of the places in __objects in typed
+    # arrays, kept when HBNB_FILE_COLUMNAR is set and None otherwise
+    __columns = Columns() if env_flag("HBNB_FILE_COLUMNAR") else None
+    # GridIndex - the places in __objects by latitude and longitude, in
+    # cells of HBNB_FILE_GEO_CELL degrees
+    __grid = GridIndex(float(os.getenv("HBNB_FILE_GEO_CELL", 0.05)))
+    # set - keys added, modified or deleted since the last save
+    __dirty = set()
+    # dictionary - <class name>.id -> digest of the record's JSON text, for
+    # every record in the JSON file and journal as last read or written
+    __disk = {}
+    # tuple - file_stamp() of the JSON file and of the journal as last
+    # read or written, None before the first reload() or save()
+    __stamp = None
+    # dictionary - partition file name -> (file_stamp() as last read or
+    # written, set of the keys of the records in it)
+    __partitions = {}
+    # LazyIndex - where the records are in the JSON file, in lazy mode
+    __index = LazyIndex()
+    # dictionary - <class name> -> set of the keys of records that are in
+    # the JSON file but not built into __objects yet
+    __unloaded = {}
+    # dictionary - the sorted ids of every object, built or not, of a class
+    # that has been paged through, by class name
+    __sorted = {}
+    # OrderedDict - keys of the unmodified objects built lazily, least
+    # recently used first; only kept while __lazy_max bounds them
+    __resident = OrderedDict()
+    # Lock - held by the readers moving a key to the end of __resident,
+    # which the writers only change under the exclusive lock
+    __recency_lock = threading.Lock()
+    # WeakValueDictionary - objects dropped past __lazy_max that are still
+    # referenced elsewhere, so that changes made to them are not lost
+    __evicted = weakref.WeakValueDictionary()
+
+    def all(self, cls=None, load=None):
+        """returns a dictionary of the objects, or of those of class cls
+
+        The dictionary is a copy that later changes to the storage leave
+        as it is, so it can be iterated while other threads write.
+        load lists relationships of cls to prefetch, as in DBStorage; a
+        ValueError is raised if it is given without cls.
+        """
+        name = None if cls is None else class_name(cls)
+        if load and cls is None:
+            raise ValueError("load needs the class it applies to")
+        if load:
+            self.__prefetch(name, load)
+        with self.__lock.reading():
+            if name is not None and not self.__unloaded.get(name):
+                return dict(self.__by_class.get(name, {}))
+            if name is None and not any(self.__unloaded.values()):
+                return dict(self.__objects)
+        with self.__lock.writing():
+            if name is not None:
+                objs = dict(self.__by_class.get(name, {}))
+                unloaded = [self.__unloaded.get(name, ())]
+            else:
+                objs = dict(self.__objects)
+                unloaded = list(self.__unloaded.values())
+            for keys in unloaded:
+                for key in list(keys):
+                    objs[key] = self.__build(key)
+            return objs
 
-    def all(self, cls=None):
-        """returns the dictionary __objects"""
-        if cls is not None:
-            new_dict = {}
-            for key, value in self.__objects.items():
-                if cls == value.__class__ or cls == value.__class__.__name__:
-                    new_dict[key] = value
-            return new_dict
-        return self.__objects
+    def iter(self, cls=None, batch_size=1000, load=None):
+        """yields the objects, or those of class cls, one at a time
+
+        Only the keys are copied up front: records not built yet are
+        built as they are reached and, in lazy mode, may be dropped again
+        afterwards. batch_size is accepted for parity with DBStorage, and
+        load is as in all().
+        """
+        if load and cls is None:
+            raise ValueError("load needs the class it applies to")
+        names = list(classes) if cls is None else [class_name(cls)]
+        if load:
+            self.__prefetch(names[0], load)
+        for name in names:
+            with self.__lock.reading():
+                keys = list(self.__by_class.get(name, ()))
+                keys.extend(self.__unloaded.get(name, ()))
+            for key in keys:
+                obj = self.__fetch(name, key)
+                if obj is not None:
+                    yield obj
+
+    def __prefetch(self, name, load):
+        """builds the objects behind the relationships in load of class name
+
+        Each entry is a relationship property, or a dotted path of them
+        such as "cities.places". Once a child class has no records left to
+        build, the properties answer from the foreign key index rather
+        than scanning that class once per parent.
+        """
+        for path in load:
+            owner = name
+            for attribute in path.split("."):
+                if (owner, attribute) not in RELATIONSHIPS:
+                    raise AttributeError("{} has no relationship {}".
+                                         format(owner, attribute))
+                owner = RELATIONSHIPS[(owner, attribute)][0]
+                if self.__unloaded.get(owner):
+                    self.all(owner)
 
     def new(self, obj):
         """sets in __objects the obj with key <obj class name>.id"""
         if obj is not None:
             key = obj.__class__.__name__ + "." + obj.id
-            self.__objects[key] = obj
+            with self.__lock.writing():
+                self.__add(key, obj)
+                self.__dirty.add(key)
+
+    def touch(self, obj, name=None, old=None):
+        """flags obj as modified if it is stored in __objects
+
+        name is the attribute that was set and old its previous value.
+        """
+        key = obj.__class__.__name__ + "." + str(obj._attribute("id"))
+        stored = self.__objects.get(key)
+        if stored is not obj and self.__evicted.get(key) is not obj:
+            # most objects changed are not stored yet, skip the lock then
+            return
+        if (stored is obj and key in self.__dirty and
+                name not in FOREIGN_KEYS and
+                (name not in NUMERIC or obj.__class__.__name__ != "Place")):
+            # already flagged, and no index follows name: nothing to do.
+            # Flushes empty __dirty before serializing, so the new value
+            # is written by the one in progress or by the next
+            return
+        with self.__lock.writing():
+            self.__touch(key, obj, name, old)
+
+    def __touch(self, key, obj, name, old):
+        """flags obj, stored under key, as modified"""
+        if self.__objects.get(key) is obj:
+            self.__dirty.add(key)
+            self.__resident.pop(key, None)
+            if name in FOREIGN_KEYS:
+                children = self.__children.get((obj.__class__.__name__, name))
+                if children is not None and old in children:
+                    children[old].pop(key, None)
+                    if not children[old]:
+                        del children[old]
+                self.__index_child(key, obj, (name,))
+            if (obj.__class__.__name__ == "Place" and
+                    (name in NUMERIC or name in GROUPS)):
+                self.__index_place(key, obj)
+        elif self.__evicted.get(key) is obj:
+            self.__add(key, obj)
+            self.__dirty.add(key)
+
+    def __add(self, key, obj):
+        """stores obj under key in __objects and in its class bucket"""
+        name = obj.__class__.__name__
+        if (name in self.__sorted and
+                key not in self.__by_class.get(name, ()) and
+                key not in self.__unloaded.get(name, ())):
+            bisect.insort(self.__sorted[name], key.split(".", 1)[1])
+        replaced = self.__objects.get(key)
+        if replaced is not None and replaced is not obj:
+            self.__unindex_child(key, replaced)
+        self.__objects[key] = obj
+        self.__by_class.setdefault(name, {})[key] = obj
+        self.__index_child(key, obj, FOREIGN_KEYS)
+        if name == "Place":
+            self.__index_place(key, obj)
+        if self.__unloaded.get(name):
+            self.__unloaded[name].discard(key)
+        self.__resident.pop(key, None)
+
+    def __remove(self, key):
+        """drops key from __objects and from its class bucket"""
+        obj = self.__objects.pop(key, None)
+        if obj is not None:
+            bucket = self.__by_class.get(obj.__class__.__name__)
+            if bucket is not None:
+                bucket.pop(key, None)
+            self.__unindex_child(key, obj)
+            self.__grid.remove(key)
+            if self.__columns is not None:
+                self.__columns.remove(key)
+        self.__resident.pop(key, None)
+        return obj
+
+    def __drop(self, key):
+        """forgets key, whether its object is built or not"""
+        name, id = key.split(".", 1)
+        self.__remove(key)
+        self.__unloaded.get(name, set()).discard(key)
+        ids = self.__sorted.get(name)
+        if ids is not None:
+            i = bisect.bisect_left(ids, id)
+            if i < len(ids) and ids[i] == id:
+                del ids[i]
+
+    def __index_place(self, key, obj):
+        """writes the place obj, stored under key, to the place indexes"""
+        self.__grid.set(key, getattr(obj, "latitude", None),
+                        getattr(obj, "longitude", None))
+        if self.__columns is not None:
+            self.__columns.set(key, obj)
+
+    def __index_child(self, key, obj, attributes):
+        """files obj under the parents its foreign key attributes name"""
+        name = obj.__class__.__name__
+        for attribute in attributes:
+            parent_id = getattr(obj, attribute, None)
+            if parent_id:
+                children = self.__children.setdefault((name, attribute), {})
+                children.setdefault(parent_id, {})[key] = obj
+
+    def __unindex_child(self, key, obj):
+        """removes obj from under the parents it is filed under"""
+        name = obj.__class__.__name__
+        for attribute in FOREIGN_KEYS:
+            children = self.__children.get((name, attribute))
+            parent_id = getattr(obj, attribute, None)
+            if children is not None and parent_id in children:
+                children[parent_id].pop(key, None)
+                if not children[parent_id]:
+                    del children[parent_id]
+
+    def children(self, cls, attribute, parent_id):
+        """returns the objects of class cls whose attribute is parent_id
+
+        attribute is one of FOREIGN_KEYS; objects are then found through
+        their index. Classes with records not built yet are scanned.
+        """
+        name = class_name(cls)
+        with self.__lock.reading():
+            if attribute in FOREIGN_KEYS and not self.__unloaded.get(name):
+                children = self.__children.get((name, attribute), {})
+                return list(children.get(parent_id, {}).values())
+        return [obj for obj in self.all(name).values()
+                if getattr(obj, attribute, None) == parent_id]
+
+    def __build(self, key):
+        """returns the object for key, building it from its record
+
+        The object is only built when it is not in __objects yet; with
+        __lazy_max set, it then joins the least recently used ones that
+        may be dropped again.
+        """
+        obj = self.__objects.get(key)
+        if obj is not None:
+            if key in self.__resident:
+                self.__resident.move_to_end(key)
+            return obj
+        obj = self.__evicted.get(key)
+        if obj is None:
+            record = json.loads(self.__index.text(key))
+            obj = classes[record["__class__"]].from_dict(record)
+        self.__add(key, obj)
+        if self.__lazy_max:
+            self.__resident[key] = None
+            while len(self.__resident) > self.__lazy_max:
+                self.__unload(self.__resident.popitem(last=False)[0])
+        return obj
+
+    def __unload(self, key):
+        """drops the object stored under key, leaving it to the index"""
+        name, id = key.split(".", 1)
+        unloaded = self.__unloaded.setdefault(name, set())
+        if (name in self.__sorted and key not in unloaded and
+                key not in self.__by_class.get(name, ())):
+            # a record new to this process, such as one another wrote
+            bisect.insort(self.__sorted[name], id)
+        obj = self.__remove(key)
+        if obj is not None:
+            self.__evicted[key] = obj
+        unloaded.add(key)
 
     def save(self):
         """serializes __objects to the JSON file (path: __file_path)"""
-        json_objects = {}
-        for key in self.__objects:
-            json_objects[key] = self.__objects[key].to_dict()
-        with open(self.__file_path, 'w') as f:
-            json.dump(json_objects, f)
+        self.__group_commit.run(self.__flush)
+
+    def __flush(self):
+        """writes out the changes flagged since the last flush"""
+        with self.__io_lock:
+            if self.__layout == "partitioned":
+                with self.__lock.writing():
+                    if not os.path.isdir(self.__partition_dir):
+                        self.__write_partitions()
+                    elif self.__dirty:
+                        names = {partition_name(key, self.__shards)
+                                 for key in self.__dirty}
+                        self.__write_partitions(names)
+                return
+            if not self.__journal:
+                if self.__dirty or not os.path.isfile(self.__file_path):
+                    self.compact()
+                return
+            batch = []
+            with self.__lock.writing():
+                # emptied first, see touch()
+                keys = list(self.__dirty)
+                self.__dirty.clear()
+                for key in keys:
+                    obj = self.__objects.get(key)
+                    if obj is None:
+                        self.__disk.pop(key, None)
+                        text = "null"
+                    else:
+                        text = json.dumps(obj.to_dict())
+                        self.__disk[key] = record_digest(text)
+                    # the JSON file no longer holds the latest version
+                    self.__index.offsets.pop(key, None)
+                    batch.append(json.dumps(key) + ": " + text)
+            if batch:
+                with open(self.__journal_path, 'a') as f:
+                    f.write("{" + ", ".join(batch) + "}\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+            stamp = file_stamp(self.__journal_path)
+            if stamp is not None and stamp[1] > self.__journal_max:
+                self.compact()
+            else:
+                FileStorage.__stamp = (file_stamp(self.__file_path), stamp)
+
+    def compact(self):
+        """writes every object to the JSON file and empties the journal
+
+        Objects are serialized under the lock, and the file is written
+        once it is released so that other threads can read meanwhile.
+        """
+        with self.__io_lock:
+            if self.__layout == "partitioned":
+                with self.__lock.writing():
+                    self.__write_partitions()
+                return
+            with self.__lock.writing():
+                self.__dirty.clear()
+                texts = dict(zip(self.__objects, map(
+                    json.dumps, to_dicts(self.__objects.values()))))
+                for keys in self.__unloaded.values():
+                    for key in keys:
+                        texts[key] = self.__index.text(key)
+            data = format_snapshot(texts)
+            if self.__checksum:
+                data = checksummed(data)
+            write_atomic(self.__file_path, data)
+            try:
+                os.remove(self.__journal_path)
+            except FileNotFoundError:
+                pass
+            with self.__lock.writing():
+                self.__disk.clear()
+                self.__disk.update((key, record_digest(text))
+                                   for key, text in texts.items())
+                FileStorage.__stamp = (file_stamp(self.__file_path), None)
+                if self.__lazy:
+                    self.__index.open(self.__file_path,
+                                      snapshot_offsets(texts))
+                    # objects unchanged since now match their records and
+                    # may be dropped
+                    if self.__lazy_max:
+                        for key in self.__objects:
+                            if key in texts and key not in self.__dirty:
+                                self.__resident[key] = None
+                    while (self.__lazy_max and
+                           len(self.__resident) > self.__lazy_max):
+                        key = self.__resident.popitem(last=False)[0]
+                        self.__unload(key)
+
+    def __write_partitions(self, names=None):
+        """rewrites the partition files in names, or all of them if None"""
+        self.__dirty.clear()
+        groups = {}
+        wanted = None
+        if names is not None:
+            wanted = {name.split(".", 1)[0] for name in names}
+        for cls_name, bucket in self.__by_class.items():
+            if wanted is not None and cls_name not in wanted:
+                continue
+            for key, obj in bucket.items():
+                name = partition_name(key, self.__shards)
+                if names is None or name in names:
+                    texts = groups.setdefault(name, {})
+                    texts[key] = json.dumps(serializer(obj.__class__)(obj))
+        if names is None:
+            names = set(groups) | set(self.__partitions)
+        os.makedirs(self.__partition_dir, exist_ok=True)
+        for name in names:
+            texts = groups.get(name, {})
+            data = format_snapshot(texts)
+            if self.__checksum:
+                data = checksummed(data)
+            path = os.path.join(self.__partition_dir, name)
+            write_atomic(path, data)
+            old_keys = self.__partitions.get(name, (None, set()))[1]
+            for key in old_keys.difference(texts):
+                self.__disk.pop(key, None)
+            for key, text in texts.items():
+                self.__disk[key] = record_digest(text)
+            self.__partitions[name] = (file_stamp(path), set(texts))
+
+    def __reload_partitions(self):
+        """brings __objects in line with the partition files
+
+        Only the partition files that changed since they were last read
+        or written are decoded. Modified objects are kept as in reload().
+        """
+        stamps = {}
+        for name in os.listdir(self.__partition_dir):
+            if name.endswith(".json"):
+                path = os.path.join(self.__partition_dir, name)
+                stamps[name] = file_stamp(path)
+        names = {name for name, stamp in stamps.items()
+                 if self.__partitions.get(name, (None,))[0] != stamp}
+        names.update(name for name in self.__partitions
+                     if name not in stamps)
+        paths = [os.path.join(self.__partition_dir, name)
+                 for name in names if name in stamps]
+        decoded = decode_partitions(paths, self.__workers)
+        for name in names:
+            path = os.path.join(self.__partition_dir, name)
+            records = decoded.get(path, {})
+            old_keys = self.__partitions.get(name, (None, set()))[1]
+            for key in old_keys.difference(records):
+                self.__drop(key)
+                self.__disk.pop(key, None)
+                self.__dirty.discard(key)
+            for key, (text_digest, record) in records.items():
+                if self.__disk.get(key) != text_digest:
+                    self.__load(key, record)
+                    self.__disk[key] = text_digest
+                    self.__dirty.discard(key)
+                elif key not in self.__objects and key not in self.__dirty:
+                    self.__load(key, record)
+            if name in stamps:
+                self.__partitions[name] = (stamps[name], set(records))
+            else:
+                self.__partitions.pop(name, None)
 
     def reload(self):
-        """deserializes the JSON file to __objects"""
+        """brings __objects in line with the JSON file and its journal
+
+        Nothing is read while neither file changed since the last reload()
+        or save(), and only the records that differ from the objects
+        already loaded are deserialized. In lazy mode those records are
+        only indexed until they are asked for. Objects modified and not
+        saved yet are kept, still flagged, unless their record changed on
+        disk meanwhile: the record written elsewhere then replaces them.
+        In the partitioned layout the partition files are read instead,
+        falling back to the JSON file until they have been written.
+        """
+        if self.__layout != "partitioned":
+            with self.__lock.reading():
+                stamp = (file_stamp(self.__file_path),
+                         file_stamp(self.__journal_path))
+                if stamp == self.__stamp:
+                    return
+        with self.__io_lock, self.__lock.writing():
+            self.__reload()
+
+    def __reload(self):
+        """reload() once the locks are held"""
+        if (self.__layout == "partitioned" and
+                os.path.isdir(self.__partition_dir)):
+            self.__reload_partitions()
+            return
+        stamp = (file_stamp(self.__file_path),
+                 file_stamp(self.__journal_path))
+        old = self.__stamp
+        if stamp == old:
+            return
+        if (old is not None and stamp[0] == old[0] and
+                stamp[1] is not None and
+                (old[1] is None or (old[1][0] == stamp[1][0] and
+                                    old[1][1] <= stamp[1][1]))):
+            # only the journal grew: replay what was appended to it
+            offset = old[1][1] if old[1] is not None else 0
+            batches, end = self.__read_journal(offset)
+            for batch in batches:
+                for key, record in batch.items():
+                    self.__index.offsets.pop(key, None)
+                    self.__dirty.discard(key)
+                    if record is None:
+                        self.__drop(key)
+                        self.__disk.pop(key, None)
+                    else:
+                        self.__load(key, record)
+                        self.__disk[key] = record_digest(json.dumps(record))
+            FileStorage.__stamp = (stamp[0], journal_stamp(stamp[1], end))
+            return
+        # the file is read into a new index, so that the records of the
+        # current one stay readable if it is rejected
+        index = LazyIndex()
+        hashes = None
+        if self.__lazy:
+            try:
+                hashes = index.open(self.__file_path)
+            except ValueError:
+                # not written one record per line, load it all instead
+                pass
+        if hashes is None:
+            records = read_snapshot(self.__file_path)
+        else:
+            records = dict.fromkeys(hashes)
+        self.__index.close()
+        FileStorage.__index = index
+        batches, end = self.__read_journal(0)
+        for batch in batches:
+            for key, record in batch.items():
+                self.__index.offsets.pop(key, None)
+                if record is None:
+                    records.pop(key, None)
+                else:
+                    records[key] = record
+        disk = {}
+        for key, record in records.items():
+            if record is None:
+                text = None
+                disk[key] = hashes[key]
+            elif isinstance(record, str):
+                text = record
+                disk[key] = record_digest(text)
+            else:
+                text = json.dumps(record)
+                disk[key] = record_digest(text)
+            if self.__disk.get(key) == disk[key] and (
+                    key in self.__dirty or key in self.__objects):
+                # unchanged on disk: a modified object stays as it is
+                continue
+            self.__dirty.discard(key)
+            if text is None:
+                changed = self.__disk.get(key) != disk[key]
+                self.__unload(key)
+                if changed:
+                    self.__evicted.pop(key, None)
+            else:
+                self.__load(key, record if isinstance(record, dict)
+                            else json.loads(text))
+        for key in self.__disk:
+            if key not in disk:
+                self.__drop(key)
+                self.__dirty.discard(key)
+        self.__disk.clear()
+        self.__disk.update(disk)
+        FileStorage.__stamp = (stamp[0], journal_stamp(stamp[1], end))
+
+    def __load(self, key, record):
+        """stores under key a new instance built from its record"""
+        self.__add(key, classes[record["__class__"]].from_dict(record))
+
+    def __read_journal(self, offset):
+        """returns the batches of changes in the journal past offset
+
+        Also returns the offset just past the last complete batch; a
+        final line without its newline is a write still in progress or
+        torn by a crash and is left for a later read.
+        """
+        batches = []
         try:
-            with open(self.__file_path, 'r') as f:
-                jo = json.load(f)
-            for key in jo:
-                self.__objects[key] = classes[jo[key]["__class__"]](**jo[key])
-        except:
+            with open(self.__journal_path, 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        batches.append(json.loads(line))
+                    except ValueError:
+                        break
+                    offset += len(line)
+        except FileNotFoundError:
             pass
+        return batches, offset
 
     def delete(self, obj=None):
         """delete obj from __objects if it’s inside"""
         if obj is not None:
-            key = obj.__class__.__name__ + '.' + obj.id
-            if key in self.__objects:
-                del self.__objects[key]
+            with self.__lock.writing():
+                self.__delete(obj)
+
+    def __delete(self, obj):
+        """delete() once the lock is held"""
+        key = obj.__class__.__name__ + '.' + obj.id
+        if (key in self.__objects or
+                key in self.__unloaded.get(obj.__class__.__name__, ())):
+            self.__drop(key)
+            self.__dirty.add(key)
+
+    def bulk_new(self, objs):
+        """adds every object of objs and saves them with a single write"""
+        with self.__lock.writing():
+            for obj in objs:
+                key = obj.__class__.__name__ + "." + obj.id
+                self.__add(key, obj)
+                self.__dirty.add(key)
+        self.save()
+
+    def bulk_update(self, objs):
+        """stamps updated_at on every object of objs and saves them
+
+        Like BaseModel.save() for each object, but with a single write.
+        """
+        objs = list(objs)
+        now = datetime.utcnow()
+        for obj in objs:
+            obj.updated_at = now
+        self.bulk_new(objs)
+
+    def bulk_delete(self, objs):
+        """deletes every object of objs and saves with a single write"""
+        with self.__lock.writing():
+            for obj in objs:
+                self.__delete(obj)
+        self.save()
 
     def close(self):
         """call reload() method for deserializing the JSON file to objects"""
@@ -73,27 +1105,178 @@ class FileStorage:
         '''
             Retrieve an obj w/class name and id
         '''
-        result = None
+        if cls is None or id is None:
+            return None
+        name = class_name(cls)
+        return self.__fetch(name, name + "." + id)
 
-        try:
-            for v in self.__objects.values():
-                if v.id == id:
-                    result = v
-        except BaseException:
-            pass
+    def __fetch(self, name, key):
+        """returns the object of class name stored under key, or None"""
+        with self.__lock.reading():
+            obj = self.__objects.get(key)
+            if obj is not None:
+                if key in self.__resident:
+                    with self.__recency_lock:
+                        self.__resident.move_to_end(key)
+                return obj
+            if key not in self.__unloaded.get(name, ()):
+                return None
+        with self.__lock.writing():
+            if key in self.__objects or key in self.__unloaded.get(name, ()):
+                return self.__build(key)
+            return None
+
+    def page(self, cls, after=None, limit=100, order_by="id", **filters):
+        '''
+            Return up to limit objects of cls past the cursor after,
+            ordered by order_by then id, and the cursor of the next page
+        '''
+        name = class_name(cls)
+        start = None if after is None else decode_cursor(after)
+        if order_by == "id" and not filters:
+            objs = []
+            for id in self.__ids_after(name, start and start[1]):
+                obj = self.__fetch(name, name + "." + id)
+                if obj is not None:
+                    objs.append(obj)
+                    if len(objs) > limit:
+                        break
+        else:
+            fks = [attribute for attribute in filters
+                   if attribute in FOREIGN_KEYS]
+            if fks:
+                objs = self.children(name, fks[0], filters[fks[0]])
+            else:
+                objs = list(self.all(name).values())
+            objs = [obj for obj in objs
+                    if all(getattr(obj, attribute, None) == value
+                           for attribute, value in filters.items())]
+            objs.sort(key=lambda obj: sort_key(sort_value(obj, order_by),
+                                               obj.id))
+            if start is not None:
+                objs = [obj for obj in objs
+                        if sort_key(sort_value(obj, order_by), obj.id) >
+                        sort_key(*start)]
+        if len(objs) > limit:
+            return objs[:limit], encode_cursor(objs[limit - 1], order_by)
+        return objs, None
+
+    def __ids_after(self, name, id):
+        '''
+            Yield the ids of class name past id, in order
+        '''
+        with self.__lock.reading():
+            built = name in self.__sorted
+        if not built:
+            with self.__lock.writing():
+                if name not in self.__sorted:
+                    ids = [key.split(".", 1)[1] for key in
+                           self.__by_class.get(name, ())]
+                    ids.extend(key.split(".", 1)[1] for key in
+                               self.__unloaded.get(name, ()))
+                    self.__sorted[name] = sorted(ids)
+        while True:
+            with self.__lock.reading():
+                ids = self.__sorted[name]
+                i = 0 if id is None else bisect.bisect_right(ids, id)
+                batch = ids[i:i + 100]
+            if not batch:
+                return
+            for id in batch:
+                yield id
+
+    def query(self, cls):
+        '''
+            Return a Query on the objects of cls
+        '''
+        return Query(self, class_name(cls))
+
+    def run(self, query, count=False):
+        '''
+            Return the objects matching query, or their number if count
+            is set. An id or foreign key equality is answered from the
+            indexes; other conditions are checked on the objects found.
+        '''
+        name = class_name(query.cls)
+        objs = None
+        for attribute, op, value in query.filters:
+            if op == "eq" and attribute == "id" and isinstance(value, str):
+                obj = self.get(name, value)
+                objs = [] if obj is None else [obj]
+                break
+            if op == "eq" and attribute in FOREIGN_KEYS:
+                objs = self.children(name, attribute, value)
+                break
+        if objs is None and name == "Place" and self.__columns is not None:
+            with self.__lock.reading():
+                if not self.__unloaded.get(name):
+                    keys = self.__columns.select(query.filters)
+                    if keys is not None:
+                        objs = [self.__objects[key] for key in keys]
+        if objs is None:
+            objs = self.all(name).values()
+        objs = [obj for obj in objs if matches(obj, query.filters)]
+        objs.sort(key=lambda obj: obj.id)
+        for attribute, descending in reversed(query.ordering):
+            objs.sort(key=lambda obj: order_key(obj, attribute),
+                      reverse=descending)
+        end = None
+        if query.limit_count is not None:
+            end = query.offset_count + query.limit_count
+        objs = objs[query.offset_count:end]
+        return len(objs) if count else objs
 
-        return result
+    def aggregate(self, cls, attribute, by=None):
+        '''
+            Return {group: {"count", "min", "max", "avg"}} for the numeric
+            attribute of the objects of cls, grouped by their attribute by
+            or all in group None. The Place columns answer it when kept.
+        '''
+        name = class_name(cls)
+        if (name == "Place" and self.__columns is not None and
+                attribute in NUMERIC and (by is None or by in GROUPS)):
+            with self.__lock.reading():
+                if not self.__unloaded.get(name):
+                    return self.__columns.aggregate(attribute, by)
+        return aggregate(self.all(name).values(), attribute, by)
+
+    def nearby(self, latitude, longitude, radius, limit=None):
+        '''
+            Return (distance, place) for the places within radius km of
+            a point, nearest first and at most limit, found in the grid
+        '''
+        with self.__lock.reading():
+            if not self.__unloaded.get("Place"):
+                return [(km, self.__objects[key]) for km, key in
+                        self.__grid.nearby(latitude, longitude, radius,
+                                           limit)]
+        places = self.all(Place)
+        points = []
+        for key, obj in places.items():
+            point = position(getattr(obj, "latitude", None),
+                             getattr(obj, "longitude", None))
+            if point is not None:
+                points.append((key,) + point)
+        return [(km, places[key]) for km, key in
+                within(points, latitude, longitude, radius, limit)]
 
     def count(self, cls=None):
         '''
             Count num objects in FileStorage
         '''
-        cls_counter = 0
+        with self.__lock.reading():
+            if cls is not None:
+                name = class_name(cls)
+                return (len(self.__by_class.get(name, ())) +
+                        len(self.__unloaded.get(name, ())))
+            return (len(self.__objects) +
+                    sum(map(len, self.__unloaded.values())))
 
-        if cls is not None:
-            for k in self.__objects.keys():
-                if cls in k:
-                    cls_counter += 1
-        else:
-            cls_counter = len(self.__objects)
-        return cls_counter
+    def counts(self):
+        '''
+            Count the objects of every class at once
+        '''
+        with self.__lock.reading():
+            return {name: (len(self.__by_class.get(name, ())) +
+                           len(self.__unloaded.get(name, ())))
+                    for name in classes}
@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+"""
+Contains the class GridIndex, a spatial index of the places by latitude
+and longitude
+"""
+
+import heapq
+import math
+
+# float - mean radius of the Earth in km
+EARTH_RADIUS = 6371.0088
+
+
+def position(latitude, longitude):
+    """returns (latitude, longitude) as floats, or None if not a point
+
+    Only numbers within [-90, 90] and [-180, 180] are a point.
+    """
+    for value in (latitude, longitude):
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            return None
+    if -90 <= latitude <= 90 and -180 <= longitude <= 180:
+        return float(latitude), float(longitude)
+    return None
+
+
+def distance(lat1, lng1, lat2, lng2):
+    """returns the great-circle distance in km between two points"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounds(latitude, longitude, radius):
+    """returns the box holding every point within radius km of a point
+
+    The box is (min latitude, max latitude, longitude ranges): a box
+    crossing the antimeridian has two ranges, one reaching a pole spans
+    every longitude.
+    """
+    angle = radius / EARTH_RADIUS
+    lat_min = latitude - math.degrees(angle)
+    lat_max = latitude + math.degrees(angle)
+    if lat_min <= -90 or lat_max >= 90:
+        return max(lat_min, -90.0), min(lat_max, 90.0), [(-180.0, 180.0)]
+    span = math.degrees(math.asin(math.sin(angle) /
+                                  math.cos(math.radians(latitude))))
+    lng_min, lng_max = longitude - span, longitude + span
+    if lng_min < -180:
+        return lat_min, lat_max, [(lng_min + 360, 180.0), (-180.0, lng_max)]
+    if lng_max > 180:
+        return lat_min, lat_max, [(lng_min, 180.0), (-180.0, lng_max - 360)]
+    return lat_min, lat_max, [(lng_min, lng_max)]
+
+
+def within(points, latitude, longitude, radius, limit=None):
+    """returns (distance, key) for the points within radius km, nearest first
+
+    points are (key, latitude, longitude); at most limit are returned.
+    """
+    lat_min, lat_max, lng_ranges = bounds(latitude, longitude, radius)
+    lat0, lng0 = math.radians(latitude), math.radians(longitude)
+    cos0 = math.cos(lat0)
+    # the haversine of the points within radius is at most this
+    most = math.sin(min(radius / EARTH_RADIUS, math.pi) / 2) ** 2
+    sin, cos, radians = math.sin, math.cos, math.radians
+    low, high = lng_ranges[0]
+    other = lng_ranges[1] if len(lng_ranges) > 1 else (low, high)
+    found = []
+    for key, lat, lng in points:
+        if (lat_min <= lat <= lat_max and
+                (low <= lng <= high or other[0] <= lng <= other[1])):
+            lat, lng = radians(lat), radians(lng)
+            h = (sin((lat - lat0) / 2) ** 2 +
+                 cos0 * cos(lat) * sin((lng - lng0) / 2) ** 2)
+            if h <= most:
+                found.append((h, key))
+    found = [(2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(h))), key)
+             for h, key in found]
+    if limit is None:
+        found.sort()
+        return found
+    return heapq.nsmallest(limit, found)
+
+
+class GridIndex:
+    """the positions of a set of objects, bucketed in a grid of cells
+
+    Each cell spans size degrees of latitude and of longitude. A search
+    only looks at the cells overlapping the box around its circle, or at
+    the occupied cells if there are fewer of them.
+    """
+
+    def __init__(self, size=0.05):
+        """creates an empty grid of cells of size degrees"""
+        self.size = size
+        self.cells = {}
+        self.positions = {}
+
+    def __len__(self):
+        """returns the number of objects with a position"""
+        return len(self.positions)
+
+    def __cell(self, latitude, longitude):
+        """returns the (row, column) of the cell holding a point"""
+        return (int((latitude + 90) // self.size),
+                int((longitude + 180) // self.size))
+
+    def set(self, key, latitude, longitude):
+        """moves key to a point, or removes it if the values are not one"""
+        point = position(latitude, longitude)
+        if point is not None and self.positions.get(key) == point:
+            return
+        self.remove(key)
+        if point is None:
+            return
+        self.positions[key] = point
+        self.cells.setdefault(self.__cell(*point), {})[key] = point
+
+    def remove(self, key):
+        """removes key, if it has a position"""
+        point = self.positions.pop(key, None)
+        if point is None:
+            return
+        cell = self.__cell(*point)
+        bucket = self.cells[cell]
+        del bucket[key]
+        if not bucket:
+            del self.cells[cell]
+
+    def __buckets(self, lat_min, lat_max, lng_ranges):
+        """yields the cells that overlap the box"""
+        rows = range(self.__cell(lat_min, 0)[0],
+                     self.__cell(lat_max, 0)[0] + 1)
+        columns = [range(self.__cell(0, low)[1], self.__cell(0, high)[1] + 1)
+                   for low, high in lng_ranges]
+        if len(rows) * sum(map(len, columns)) > len(self.cells):
+            for (row, column), bucket in self.cells.items():
+                if row in rows and any(column in c for c in columns):
+                    yield bucket
+            return
+        for row in rows:
+            for c in columns:
+                for column in c:
+                    bucket = self.cells.get((row, column))
+                    if bucket:
+                        yield bucket
+
+    def nearby(self, latitude, longitude, radius, limit=None):
+        """returns (distance, key) for the keys within radius km of a point
+
+        The nearest come first, at most limit of them.
+        """
+        lat_min, lat_max, lng_ranges = bounds(latitude, longitude, radius)
+        points = ((key, lat, lng)
+                  for bucket in self.__buckets(lat_min, lat_max, lng_ranges)
+                  for key, (lat, lng) in bucket.items())
+        return within(points, latitude, longitude, radius, limit)
@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+"""
+Contains the class Query, a query on the objects of one class
+"""
+
+import operator
+
+
+def contains(value, part):
+    """returns True if the string part is in value, ignoring case
+
+    Both engines ignore case, as LIKE does on the default collations;
+    % and _ in part are plain characters. False when value is None.
+    """
+    if not isinstance(value, str) or not isinstance(part, str):
+        return False
+    return part.lower() in value.lower()
+
+
+def one_of(value, values):
+    """returns True if value is one of values"""
+    return value in values
+
+
+# dictionary - the comparisons that follow "__" in a filter name, such as
+# price_by_night__lte; a filter without one compares with eq
+OPERATORS = {"eq": operator.eq, "ne": operator.ne,
+             "lt": operator.lt, "lte": operator.le,
+             "gt": operator.gt, "gte": operator.ge,
+             "in": one_of, "contains": contains}
+
+
+def matches(obj, filters):
+    """returns True if obj meets every (attribute, op, value) of filters
+
+    As in SQL, a comparison of None with any other value fails, as does
+    one that cannot be made, such as a string with a number.
+    """
+    for attribute, op, value in filters:
+        actual = getattr(obj, attribute, None)
+        if actual is None and value is not None:
+            return False
+        try:
+            if not OPERATORS[op](actual, value):
+                return False
+        except TypeError:
+            return False
+    return True
+
+
+def order_key(obj, attribute):
+    """returns the key ordering objects by attribute, None first"""
+    value = getattr(obj, attribute, None)
+    return (value is not None, value)
+
+
+def parse_filter(name):
+    """returns the attribute and the operator named by a filter name"""
+    attribute, _, op = name.partition("__")
+    if not op:
+        op = "eq"
+    if op not in OPERATORS:
+        raise ValueError("unknown operator: " + op)
+    return attribute, op
+
+
+class Query:
+    """a query on the objects of one class, refined by chaining calls
+
+    Every call returns a new query, so a query can be shared and refined
+    in different ways. The storage engine runs it when its objects are
+    asked for, DBStorage as SQL and FileStorage against its indexes.
+    """
+
+    def __init__(self, storage, cls):
+        """creates a query on every object of cls in storage"""
+        self.storage = storage
+        self.cls = cls
+        self.filters = ()
+        self.ordering = ()
+        self.limit_count = None
+        self.offset_count = 0
+
+    def __copy(self, **changes):
+        """returns a copy of the query with changes to its attributes"""
+        query = Query(self.storage, self.cls)
+        query.__dict__.update(self.__dict__)
+        query.__dict__.update(changes)
+        return query
+
+    def filter(self, **conditions):
+        """keeps the objects matching every condition
+
+        Each condition is attribute=value, or attribute__op=value with op
+        one of OPERATORS, such as price_by_night__lte=100. contains
+        matches part of a string, ignoring case.
+        """
+        filters = []
+        for name, value in conditions.items():
+            attribute, op = parse_filter(name)
+            filters.append((attribute, op, value))
+        return self.__copy(filters=self.filters + tuple(filters))
+
+    def order_by(self, *attributes):
+        """orders the objects by attributes, descending for a leading -"""
+        ordering = tuple((attribute.lstrip("-"), attribute.startswith("-"))
+                         for attribute in attributes)
+        return self.__copy(ordering=self.ordering + ordering)
+
+    def limit(self, count):
+        """keeps at most count objects"""
+        return self.__copy(limit_count=count)
+
+    def offset(self, count):
+        """skips the first count objects"""
+        return self.__copy(offset_count=count)
+
+    def all(self):
+        """returns the list of the objects"""
+        return self.storage.run(self)
+
+    def first(self):
+        """returns the first object, or None"""
+        objs = self.limit(1).all()
+        return objs[0] if objs else None
+
+    def count(self):
+        """returns the number of objects"""
+        return self.storage.run(self, count=True)
+
+    def __iter__(self):
+        """iterates over the objects"""
+        return iter(self.all())
@@ -3,11 +3,15 @@
 from datetime import datetime
 import inspect
 import models
+import os
 import pep8 as pycodestyle
+import subprocess
+import sys
 import time
 import unittest
 from unittest import mock
 BaseModel = models.base_model.BaseModel
+to_dicts = models.base_model.to_dicts
 module_doc = models.base_model.__doc__
 
 
@@ -138,6 +142,34 @@ class TestBaseModel(unittest.TestCase):
         self.assertEqual(new_d["created_at"], bm.created_at.strftime(t_format))
         self.assertEqual(new_d["updated_at"], bm.updated_at.strftime(t_format))
 
+    def test_to_dicts(self):
+        """test that to_dicts gives the to_dict of each object"""
+        t_format = "%Y-%m-%dT%H:%M:%S.%f"
+        bm = BaseModel()
+        bm.updated_at = datetime(2017, 6, 14, 22, 31, 3)
+        other = BaseModel()
+        other.name = "Holberton"
+        dicts = to_dicts([bm, other])
+        self.assertEqual(dicts, [bm.to_dict(), other.to_dict()])
+        self.assertEqual(dicts[0]["updated_at"], "2017-06-14T22:31:03.000000")
+        self.assertEqual(dicts[1]["created_at"],
+                         other.created_at.strftime(t_format))
+        self.assertEqual(to_dicts([]), [])
+
+    def test_from_dict(self):
+        """test that from_dict builds the instance BaseModel(**d) builds"""
+        bm = BaseModel()
+        bm.name = "Holberton"
+        d = bm.to_dict()
+        with mock.patch('models.storage') as mock_storage:
+            new = BaseModel.from_dict(d)
+        self.assertFalse(mock_storage.touch.called)
+        self.assertIs(type(new), BaseModel)
+        self.assertEqual(new.to_dict(), d)
+        self.assertEqual(new.to_dict(), BaseModel(**d).to_dict())
+        self.assertEqual(new.created_at, bm.created_at)
+        self.assertEqual(d["__class__"], "BaseModel")
+
     def test_str(self):
         """test that the str method has the correct output"""
         inst = BaseModel()
@@ -158,3 +190,20 @@ class TestBaseModel(unittest.TestCase):
         self.assertEqual(old_created_at, new_created_at)
         self.assertTrue(mock_storage.new.called)
         self.assertTrue(mock_storage.save.called)
+
+    @unittest.skipIf(models.storage_t == 'db', "compact layout is file only")
+    def test_compact_layout(self):
+        """Test HBNB_FILE_COMPACT models behave like the default ones"""
+        script = """if True:
+            from models.city import City
+            city = City(name="Fresno", extra=1)
+            assert City.__slots__ == ("state_id", "name")
+            assert City().name == "" and city.name == "Fresno"
+            assert city.to_dict()["extra"] == 1
+            assert City(**city.to_dict()).to_dict() == city.to_dict()
+            assert str(city).startswith("[City] (" + city.id + ") {'id'")
+            """
+        env = dict(os.environ, HBNB_FILE_COMPACT="1")
+        result = subprocess.run([sys.executable, "-c", script], env=env,
+                                stderr=subprocess.PIPE)
+        self.assertEqual(result.returncode, 0, result.stderr)
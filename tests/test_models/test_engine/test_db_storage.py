@@ -18,7 +18,11 @@ from models import storage
 import json
 import os
 import pep8
+import sqlalchemy
+import tempfile
+import threading
 import unittest
+from unittest import mock
 DBStorage = db_storage.DBStorage
 classes = {"Amenity": Amenity, "City": City, "Place": Place,
            "Review": Review, "State": State, "User": User}
@@ -102,3 +106,209 @@ class TestFileStorage(unittest.TestCase):
     @unittest.skipIf(models.storage_t != 'db', "not testing db storage")
     def test_save(self):
         """Test that save properly saves objects to file.json"""
+
+
+@unittest.skipIf(models.storage_t != 'db', "not testing db storage")
+class TestDBStorageReplicas(unittest.TestCase):
+    """Test reads routed to replicas, with SQLite files as databases"""
+    def setUp(self):
+        """Create a primary and a replica holding different rows"""
+        self.tmp = tempfile.TemporaryDirectory()
+        primary = "sqlite:///" + os.path.join(self.tmp.name, "primary.db")
+        replica = "sqlite:///" + os.path.join(self.tmp.name, "replica.db")
+        engine = sqlalchemy.create_engine(replica)
+        models.base_model.Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(State.__table__.insert(),
+                               {"id": "r", "name": "replica"})
+        engine.dispose()
+        env = {"HBNB_DB_URL": primary, "HBNB_DB_REPLICAS": replica,
+               "HBNB_ENV": ""}
+        with mock.patch.dict(os.environ, env):
+            self.storage = DBStorage()
+        self.storage.reload()
+
+    def tearDown(self):
+        """Remove the databases"""
+        self.storage.close()
+        self.tmp.cleanup()
+
+    def test_reads_from_replica_until_write(self):
+        """Test reads use the replica, and the primary after a write"""
+        self.assertEqual(self.storage.get(State, "r").name, "replica")
+        state = State(name="primary")
+        self.storage.new(state)
+        self.storage.save()
+        self.assertIsNone(self.storage.get(State, "r"))
+        self.assertEqual(self.storage.count(State), 1)
+        self.storage.close()
+        self.assertEqual(self.storage.count(State), 1)
+        self.assertIsNone(self.storage.get(State, state.id))
+
+
+@unittest.skipIf(models.storage_t != 'db', "not testing db storage")
+class TestDBStorageSQLite(unittest.TestCase):
+    """Test DBStorage on a SQLite database file"""
+    def setUp(self):
+        """Create a storage on an empty database in a temporary directory"""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.env = {"HBNB_DB_URL": "sqlite:///" +
+                    os.path.join(self.tmp.name, "h.db"),
+                    "HBNB_DB_REPLICAS": "", "HBNB_ENV": ""}
+        self.storage = None
+        self.open_storage()
+
+    def tearDown(self):
+        """Close the storage and remove the database"""
+        self.storage.close()
+        self.storage._DBStorage__engine.dispose()
+        self.tmp.cleanup()
+
+    def open_storage(self, **env):
+        """Replace the storage with one opened with env set as well"""
+        if self.storage is not None:
+            self.storage.close()
+            self.storage._DBStorage__engine.dispose()
+        with mock.patch.dict(os.environ, dict(self.env, **env)):
+            self.storage = DBStorage()
+        self.storage.reload()
+
+    def test_sqlite_pragmas(self):
+        """Test SQLite connections use WAL and the configured settings"""
+        self.open_storage(HBNB_SQLITE_SYNCHRONOUS="FULL")
+        self.storage.new(State(name="California"))
+        self.storage.save()
+        session = self.storage._DBStorage__session
+        pragma = sqlalchemy.text
+        self.assertEqual(
+            session.execute(pragma("PRAGMA journal_mode")).scalar(),
+            "wal")
+        self.assertEqual(
+            session.execute(pragma("PRAGMA synchronous")).scalar(), 2)
+        self.assertEqual(self.storage.count(State), 1)
+
+    def test_pool_settings_and_stats(self):
+        """Test the HBNB_MYSQL_POOL_* settings and the pool statistics"""
+        self.open_storage(
+            HBNB_MYSQL_POOL_SIZE="2",
+            HBNB_MYSQL_MAX_OVERFLOW="0",
+            HBNB_MYSQL_POOL_TIMEOUT="0.2",
+            HBNB_MYSQL_POOL_RECYCLE="60",
+            HBNB_MYSQL_POOL_PRE_PING="off")
+        self.storage.new(State(name="California"))
+        self.storage.save()
+        self.storage.close()
+        engine = self.storage._DBStorage__engine
+        pool = engine.pool
+        self.assertIsInstance(pool, db_storage.TimedQueuePool)
+        self.assertEqual(pool._recycle, 60)
+        self.assertFalse(pool._pre_ping)
+        stats = self.storage.pool_stats()
+        self.assertEqual(set(stats),
+                         {"size", "checked_in", "checked_out",
+                          "overflow", "checkouts", "waits", "wait_time",
+                          "max_wait"})
+        self.assertEqual(stats["size"], 2)
+        self.assertEqual(stats["checked_out"], 0)
+        self.assertGreaterEqual(stats["checkouts"], 1)
+        self.assertEqual(stats["waits"], 0)
+        held = [engine.connect(), engine.connect()]
+        # no overflow: a third checkout times out after 0.2 seconds
+        with self.assertRaises(sqlalchemy.exc.TimeoutError):
+            engine.connect()
+        self.assertEqual(self.storage.pool_stats()["checked_out"], 2)
+        timer = threading.Timer(0.05, held.pop().close)
+        timer.start()
+        engine.connect().close()
+        timer.join()
+        held.pop().close()
+        stats = self.storage.pool_stats()
+        self.assertEqual(stats["waits"], 2)
+        self.assertGreaterEqual(stats["max_wait"], 0.2)
+        self.assertGreaterEqual(stats["wait_time"], 0.25)
+        self.assertEqual(stats["checked_out"], 0)
+
+    def test_migrate_adds_missing_indexes(self):
+        """Test migrate recreates dropped indexes and can run again"""
+        engine = self.storage._DBStorage__engine
+        declared = {index.name: table.name
+                    for table in models.base_model.Base.metadata.tables.
+                    values() for index in table.indexes}
+        self.assertIn("ix_places_city_id", declared)
+        with engine.begin() as connection:
+            for name in declared:
+                connection.execute(
+                    sqlalchemy.text("DROP INDEX {}".format(name)))
+        self.storage.close()
+        for i in range(2):
+            self.storage.reload()
+            self.storage.migrate()
+            self.storage.close()
+        inspector = sqlalchemy.inspect(engine)
+        for name, table in declared.items():
+            self.assertIn(name, [index["name"] for index in
+                                 inspector.get_indexes(table)])
+
+    def test_aggregate(self):
+        """Test aggregate groups the stats of a column in SQL"""
+        state = State(name="California")
+        user = User(email="a@b.c", password="pwd")
+        cities = [City(name="SF", state_id=state.id),
+                  City(name="LA", state_id=state.id)]
+        self.storage.bulk_new([state, user] + cities)
+        self.storage.bulk_new([Place(name="p", city_id=city.id,
+                                     user_id=user.id, price_by_night=price)
+                               for city, price in [(cities[0], 80),
+                                                   (cities[0], 120),
+                                                   (cities[1], 50)]])
+        stats = self.storage.aggregate(Place, "price_by_night", "city_id")
+        self.assertEqual(stats[cities[0].id],
+                         {"count": 2, "min": 80, "max": 120, "avg": 100})
+        self.assertEqual(stats[cities[1].id]["avg"], 50)
+        self.assertEqual(self.storage.aggregate("Place", "price_by_night"),
+                         {None: {"count": 3, "min": 50, "max": 120,
+                                 "avg": 250 / 3}})
+
+    def test_nearby(self):
+        """Test nearby searches the box then sorts places by distance"""
+        state = State(name="California")
+        user = User(email="a@b.c", password="pwd")
+        city = City(name="SF", state_id=state.id)
+        self.storage.bulk_new([state, user, city])
+        places = [Place(name="p", city_id=city.id, user_id=user.id,
+                        latitude=lat, longitude=lng)
+                  for lat, lng in [(37.7749, -122.4194),
+                                   (37.8044, -122.2712),
+                                   (34.0522, -118.2437),
+                                   (None, None)]]
+        self.storage.bulk_new(places)
+        found = self.storage.nearby(37.78, -122.42, 50)
+        self.assertEqual([place.id for km, place in found],
+                         [places[0].id, places[1].id])
+        self.assertLess(found[0][0], 1)
+        self.assertEqual(len(self.storage.nearby(37.78, -122.42, 50, 1)), 1)
+        self.assertEqual(self.storage.nearby(0, 0, 50), [])
+
+    def test_query_contains(self):
+        """Test contains matches literally and ignoring case, as
+        FileStorage does"""
+        self.storage.bulk_new([State(name=name)
+                               for name in ("Cali", "New_York", "Iowa")])
+        query = self.storage.query(State).order_by("name")
+        for part, names in (("_", ["New_York"]), ("%", []),
+                            ("cali", ["Cali"]), ("W_y", ["New_York"]),
+                            ("O", ["Iowa", "New_York"])):
+            self.assertEqual([state.name for state in
+                              query.filter(name__contains=part)], names)
+
+    def test_load_needs_class(self):
+        """Test load without a class is refused, as FileStorage does"""
+        state = State(name="California")
+        self.storage.bulk_new([state, City(name="SF", state_id=state.id)])
+        with self.assertRaises(ValueError):
+            self.storage.all(load=["cities"])
+        with self.assertRaises(ValueError):
+            list(self.storage.iter(load=["cities"]))
+        states = self.storage.all(State, load=["cities"])
+        self.assertEqual([city.name for city in
+                          states["State." + state.id].cities], ["SF"])
@@ -4,14 +4,26 @@
 '''
 
 import os
+import shutil
 import time
 import json
+import threading
 import unittest
+from unittest import mock
 import models
 from models import storage
+from models.amenity import Amenity
 from models.base_model import BaseModel
+from models.city import City
+from models.place import Place
 from models.state import State
-from models.engine.file_storage import FileStorage
+from models.engine.file_storage import FileStorage, GroupCommit
+from models.engine.file_storage import ReadWriteLock
+from models.engine.columnar import aggregate, Columns
+from models.engine.query import matches
+from models.engine.file_storage import decode_partitions, format_snapshot
+from models.engine.file_storage import record_digest
+from models.engine.file_storage import write_atomic
 
 db = os.getenv("HBNB_TYPE_STORAGE")
 
@@ -34,10 +46,13 @@ class testFileStorage(unittest.TestCase):
             Cleaning up.
         '''
 
-        try:
-            os.remove("file.json")
-        except FileNotFoundError:
-            pass
+        for path in ("file.json", "file.json.log"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        shutil.rmtree("file.json.d", ignore_errors=True)
+        self.storage.reload()
 
     def test_all_return_type(self):
         '''
@@ -147,3 +162,847 @@ class testFileStorage(unittest.TestCase):
         cls_count = self.storage.count("State")
         self.assertIsInstance(cls_count, int)
         self.assertGreaterEqual(all_count, cls_count)
+
+    def test_all_cls_matches_exact_class(self):
+        '''
+            Check all(cls) only returns objects of that exact class
+        '''
+        new_state = State()
+        self.storage.new(new_state)
+        self.storage.new(self.my_model)
+        states = self.storage.all(State)
+        self.assertIn("State." + new_state.id, states)
+        self.assertNotIn("BaseModel." + self.my_model.id, states)
+        self.assertEqual(states, self.storage.all("State"))
+        for obj in states.values():
+            self.assertIs(type(obj), State)
+
+    def test_count_follows_new_and_delete(self):
+        '''
+            Check count(cls) is kept in step by new() and delete()
+        '''
+        before = self.storage.count(State)
+        new_state = State()
+        self.storage.new(new_state)
+        self.assertEqual(self.storage.count(State), before + 1)
+        self.assertEqual(self.storage.count("State"), before + 1)
+        self.storage.delete(new_state)
+        self.assertEqual(self.storage.count(State), before)
+        self.assertNotIn("State." + new_state.id, self.storage.all(State))
+
+    def test_counts_every_class(self):
+        '''
+            Check counts() matches count() for each class
+        '''
+        self.storage.new(State())
+        counts = self.storage.counts()
+        for name in ("Amenity", "City", "Place", "Review", "State", "User"):
+            self.assertEqual(counts[name], self.storage.count(name))
+        self.assertEqual(sum(counts.values()), self.storage.count())
+
+    def test_iter_yields_stored_objects(self):
+        '''
+            Check iter() yields the same objects as all()
+        '''
+        new_state = State()
+        self.storage.new(new_state)
+        states = list(self.storage.iter(State))
+        self.assertIn(new_state, states)
+        self.assertEqual(len(states), len(self.storage.all(State)))
+        self.assertEqual(len(list(self.storage.iter())),
+                         len(self.storage.all()))
+
+    def test_page_walks_every_object_once(self):
+        '''
+            Check page() cursors walk the objects in order, once each
+        '''
+        states = [State(name=str(i % 3)) for i in range(10)]
+        for new_state in states:
+            self.storage.new(new_state)
+        for order_by in ("id", "name"):
+            seen = []
+            objs, cursor = self.storage.page(State, limit=3,
+                                             order_by=order_by)
+            while True:
+                seen.extend(objs)
+                if cursor is None:
+                    break
+                objs, cursor = self.storage.page(State, after=cursor, limit=3,
+                                                 order_by=order_by)
+            keys = [(getattr(obj, order_by), obj.id) for obj in seen]
+            self.assertEqual(keys, sorted(keys))
+            self.assertEqual(len(seen), self.storage.count(State))
+        objs, cursor = self.storage.page(State, limit=1)
+        self.storage.delete(objs[0])
+        self.storage.new(State(id="0"))
+        objs, cursor = self.storage.page(State, after=cursor, limit=100)
+        self.assertNotIn("0", [obj.id for obj in objs])
+        with self.assertRaises(ValueError):
+            self.storage.page(State, after="nonsense")
+
+    def test_page_shares_the_lock_with_readers(self):
+        '''
+            Check page() does not wait for readers once the ids are sorted
+        '''
+        self.storage.new(State())
+        self.storage.page(State, limit=1)
+        reading = threading.Event()
+        done = threading.Event()
+
+        def read():
+            with self.storage._FileStorage__lock.reading():
+                reading.set()
+                done.wait(5)
+        reader = threading.Thread(target=read)
+        reader.start()
+        reading.wait(5)
+        pager = threading.Thread(
+            target=lambda: self.storage.page(State, limit=1))
+        pager.start()
+        pager.join(2)
+        finished = not pager.is_alive()
+        done.set()
+        reader.join()
+        pager.join()
+        self.assertTrue(finished)
+
+    def test_lazy_page_sees_records_written_elsewhere(self):
+        '''
+            Check page() in lazy mode lists records another process
+            added to the JSON file
+        '''
+        self.storage._FileStorage__lazy = True
+        for name in ("Cali", "Iowa", "Ohio"):
+            self.storage.new(State(name=name))
+        self.storage.save()
+        self.storage.reload()
+        self.assertEqual(len(self.storage.page(State)[0]), 3)
+        with open("file.json", encoding="UTF8") as fd:
+            texts = {key: json.dumps(record)
+                     for key, record in json.load(fd).items()}
+        other = State(name="Utah")
+        texts["State." + other.id] = json.dumps(other.to_dict())
+        write_atomic("file.json", format_snapshot(texts))
+        self.storage.reload()
+        self.assertEqual(self.storage.count(State), 4)
+        objs = self.storage.page(State)[0]
+        self.assertEqual(len(objs), 4)
+        self.assertIn("Utah", [state.name for state in objs])
+
+    def test_touch_skips_the_lock_once_flagged(self):
+        '''
+            Check setting an attribute of a modified object does not wait
+            for readers, and is still saved
+        '''
+        state = State(name="Cali")
+        self.storage.new(state)
+        reading = threading.Event()
+        done = threading.Event()
+
+        def read():
+            with self.storage._FileStorage__lock.reading():
+                reading.set()
+                done.wait(5)
+        reader = threading.Thread(target=read)
+        reader.start()
+        reading.wait(5)
+        setter = threading.Thread(target=setattr,
+                                  args=(state, "name", "Iowa"))
+        setter.start()
+        setter.join(2)
+        finished = not setter.is_alive()
+        done.set()
+        reader.join()
+        setter.join()
+        self.assertTrue(finished)
+        self.storage.save()
+        self.storage.reload()
+        self.assertEqual(self.storage.get(State, state.id).name, "Iowa")
+
+    def test_query_filters_orders_and_limits(self):
+        '''
+            Check query() filters, orders and limits the objects
+        '''
+        city = City(name="Fresno")
+        places = [Place(city_id=city.id, name=str(i), price_by_night=i)
+                  for i in range(6)]
+        for place in places:
+            self.storage.new(place)
+        query = self.storage.query(Place).filter(city_id=city.id)
+        self.assertEqual(query.count(), 6)
+        cheap = query.filter(price_by_night__lt=3).order_by("-name")
+        self.assertEqual([p.name for p in cheap], ["2", "1", "0"])
+        self.assertEqual(cheap.limit(1).offset(1).first(), places[1])
+        self.assertEqual(query.filter(name__in=["4", "9"]).all(),
+                         [places[4]])
+        self.assertIs(self.storage.query(Place).filter(
+            id=places[5].id).first(), places[5])
+        with self.assertRaises(ValueError):
+            query.filter(name__like="x")
+
+    def test_place_columns(self):
+        '''
+            Check the Place columns answer queries and aggregates as the
+            objects do, and follow the changes made to the places
+        '''
+        columns = Columns()
+        for key, obj in self.storage.all(Place).items():
+            columns.set(key, obj)
+        city = City(name="Fresno")
+        places = [Place(city_id=city.id, name=str(i), max_guest=i % 3,
+                        price_by_night=100 + i) for i in range(6)]
+        places[5].max_guest = None
+        with mock.patch.object(FileStorage, "_FileStorage__columns", columns):
+            for place in places:
+                self.storage.new(place)
+            query = self.storage.query(Place).filter(price_by_night__gte=102,
+                                                     max_guest__ne=0)
+            self.assertCountEqual(
+                query.all(), [p for p in self.storage.all(Place).values()
+                              if matches(p, query.filters)])
+            places[2].price_by_night = "cheap"
+            query = self.storage.query(Place).filter(city_id=city.id)
+            self.assertEqual(query.filter(price_by_night__gte=102).count(), 3)
+            self.assertIn(places[2], query.filter(price_by_night__ne=5).all())
+            self.storage.delete(places[0])
+            for attribute in ("price_by_night", "max_guest"):
+                self.assertEqual(
+                    self.storage.aggregate(Place, attribute, "city_id"),
+                    aggregate(self.storage.all(Place).values(), attribute,
+                              "city_id"))
+            self.assertEqual(
+                self.storage.aggregate(Place, "price_by_night",
+                                       "city_id")[city.id],
+                {"count": 4, "min": 101, "max": 105, "avg": 103.25})
+        self.assertEqual(len(columns), self.storage.count(Place))
+
+    def test_nearby_places(self):
+        '''
+            Check nearby() finds the places around a point, nearest first,
+            and follows the places moved or deleted
+        '''
+        points = [(37.7749, -122.4194), (37.8044, -122.2712),
+                  (37.3382, -121.8863), (34.0522, -118.2437)]
+        places = [Place(name=str(i), latitude=lat, longitude=lng)
+                  for i, (lat, lng) in enumerate(points)]
+        for place in places:
+            self.storage.new(place)
+        found = self.storage.nearby(37.7749, -122.4194, 80)
+        self.assertEqual([place for km, place in found], places[:3])
+        self.assertAlmostEqual(found[1][0], 13.4, places=1)
+        self.assertEqual(self.storage.nearby(37.7749, -122.4194, 80, 1),
+                         found[:1])
+        places[3].latitude = 37.78
+        places[3].longitude = -122.42
+        self.storage.delete(places[0])
+        self.assertEqual([place for km, place in
+                          self.storage.nearby(37.7749, -122.4194, 5)],
+                         [places[3]])
+        self.assertEqual(self.storage.nearby(34.0522, -118.2437, 5), [])
+
+    def test_query_contains(self):
+        '''
+            Check contains matches literally and ignoring case, as
+            DBStorage does
+        '''
+        states = [State(name=name) for name in ("Cali", "New_York", "Iowa")]
+        for new_state in states:
+            self.storage.new(new_state)
+        query = self.storage.query(State).filter(
+            id__in=[new_state.id for new_state in states]).order_by("name")
+        for part, names in (("_", ["New_York"]), ("%", []),
+                            ("cali", ["Cali"]), ("W_y", ["New_York"]),
+                            ("O", ["Iowa", "New_York"])):
+            self.assertEqual([new_state.name for new_state in
+                              query.filter(name__contains=part)], names)
+
+    def test_get_by_class_and_name(self):
+        '''
+            Check get() finds an object by class or class name and id
+        '''
+        new_state = State()
+        self.storage.new(new_state)
+        self.assertIs(self.storage.get(State, new_state.id), new_state)
+        self.assertIs(self.storage.get("State", new_state.id), new_state)
+        self.assertIsNone(self.storage.get(BaseModel, new_state.id))
+        self.assertIsNone(self.storage.get(State, None))
+
+    def test_journal_appends_changed_records(self):
+        '''
+            Check save() in journal mode appends only the changes
+        '''
+        self.storage._FileStorage__journal = True
+        new_state = State(name="Cali")
+        self.storage.new(new_state)
+        self.storage.save()
+        key = "State." + new_state.id
+        with open("file.json.log", encoding="UTF8") as fd:
+            batch = json.loads(fd.readlines()[-1])
+        self.assertEqual(batch[key]["name"], "Cali")
+        self.storage.delete(new_state)
+        self.storage.save()
+        with open("file.json.log", encoding="UTF8") as fd:
+            lines = fd.readlines()
+        self.assertEqual(json.loads(lines[-1]), {key: None})
+        self.assertFalse(os.path.isfile("file.json"))
+
+    def test_bulk_operations_append_one_batch(self):
+        '''
+            Check each bulk operation writes a single journal batch
+        '''
+        self.storage._FileStorage__journal = True
+        states = [State(name="s") for i in range(100)]
+        self.storage.bulk_new(states)
+        before = states[0].updated_at
+        self.storage.bulk_update(states[:10])
+        self.assertGreater(states[0].updated_at, before)
+        self.storage.bulk_delete(states[10:])
+        with open("file.json.log", encoding="UTF8") as fd:
+            batches = [json.loads(line) for line in fd]
+        self.assertEqual(len(batches), 3)
+        self.assertLessEqual({"State." + new_state.id for new_state in states},
+                             set(batches[0]))
+        self.assertEqual([len(batch) for batch in batches[1:]], [10, 90])
+        self.storage.reload()
+        for new_state in states:
+            found = self.storage.get(State, new_state.id)
+            self.assertEqual(found is None, new_state in states[10:])
+
+    def test_reload_keeps_unsaved_changes(self):
+        '''
+            Check reload() keeps modified objects unless their record
+            changed on disk, in the default and journal modes
+        '''
+        for journal in (False, True):
+            self.storage._FileStorage__journal = journal
+            state = State(name="Cali")
+            other = State(name="Iowa")
+            self.storage.new(state)
+            self.storage.new(other)
+            self.storage.save()
+            state.name = "Nevada"
+            other.name = "Texas"
+            record = other.to_dict()
+            record["name"] = "Ohio"
+            with open("file.json.log", "a", encoding="UTF8") as fd:
+                fd.write(json.dumps({"State." + other.id: record}) + "\n")
+            self.storage.reload()
+            self.assertIs(self.storage.get(State, state.id), state)
+            self.assertEqual(self.storage.get(State, other.id).name, "Ohio")
+            self.storage.close()
+            self.storage.save()
+            self.storage._FileStorage__stamp = None
+            self.storage.reload()
+            reloaded = self.storage.get(State, state.id)
+            self.assertEqual(reloaded.name, "Nevada")
+            self.assertEqual(self.storage.get(State, other.id).name, "Ohio")
+
+    def test_partitioned_reload_keeps_unsaved_changes(self):
+        '''
+            Check reload() keeps modified objects in the partitioned layout
+        '''
+        self.storage._FileStorage__layout = "partitioned"
+        state = State(name="Cali")
+        self.storage.new(state)
+        self.storage.save()
+        state.name = "Iowa"
+        self.storage.reload()
+        self.assertIs(self.storage.get(State, state.id), state)
+        self.storage.save()
+        found = {}
+        for name in os.listdir("file.json.d"):
+            with open(os.path.join("file.json.d", name)) as fd:
+                found.update(json.load(fd))
+        self.assertEqual(found["State." + state.id]["name"], "Iowa")
+
+    def test_journal_compaction(self):
+        '''
+            Check the journal is folded into file.json past its threshold
+        '''
+        self.storage._FileStorage__journal = True
+        self.storage._FileStorage__journal_max = 0
+        new_state = State(name="Cali")
+        self.storage.new(new_state)
+        self.storage.save()
+        self.assertFalse(os.path.isfile("file.json.log"))
+        with open("file.json", encoding="UTF8") as fd:
+            content = json.load(fd)
+        self.assertEqual(content["State." + new_state.id]["name"], "Cali")
+
+    def test_save_skips_clean_store(self):
+        '''
+            Check save() does not rewrite file.json when nothing changed
+        '''
+        self.storage.new(self.my_model)
+        self.storage.save()
+        before = os.stat("file.json").st_mtime_ns
+        time.sleep(0.01)
+        self.storage.save()
+        self.assertEqual(os.stat("file.json").st_mtime_ns, before)
+        self.my_model.name = "changed"
+        self.storage.save()
+        self.assertNotEqual(os.stat("file.json").st_mtime_ns, before)
+
+    def test_group_commit_coalesces_saves(self):
+        '''
+            Check concurrent callers share flushes and are all released
+        '''
+        flushes = []
+        commit = GroupCommit(0.05)
+        threads = [threading.Thread(target=commit.run,
+                                    args=(lambda: flushes.append(1),))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        self.assertGreaterEqual(len(flushes), 1)
+        self.assertLess(len(flushes), 8)
+
+    def test_save_leaves_no_temporary_file(self):
+        '''
+            Check the snapshot is renamed into place, not written in place
+        '''
+        self.storage.new(self.my_model)
+        self.storage.save()
+        self.assertEqual([name for name in os.listdir(".")
+                          if name.startswith("file.json.")], [])
+
+    def test_checksum_footer(self):
+        '''
+            Check reload() verifies the checksum footer of file.json
+        '''
+        self.storage._FileStorage__checksum = True
+        new_state = State(name="Cali")
+        self.storage.new(new_state)
+        self.storage.save()
+        with open("file.json", encoding="UTF8") as fd:
+            data = fd.read()
+        self.assertIn("\n#sha256:", data)
+        self.storage.reload()
+        self.assertEqual(self.storage.get(State, new_state.id).name, "Cali")
+        with open("file.json", "w", encoding="UTF8") as fd:
+            fd.write(data.replace("Cali", "Iowa"))
+        self.assertRaises(ValueError, self.storage.reload)
+        self.assertEqual(self.storage.get(State, new_state.id).name, "Cali")
+
+    def test_reload_rejects_truncated_file(self):
+        '''
+            Check a truncated file.json is reported instead of ignored
+        '''
+        self.storage.new(self.my_model)
+        self.storage.save()
+        with open("file.json", encoding="UTF8") as fd:
+            data = fd.read()
+        with open("file.json", "w", encoding="UTF8") as fd:
+            fd.write(data[:len(data) // 2])
+        self.assertRaises(ValueError, self.storage.reload)
+
+    def test_lazy_checksum_footer(self):
+        '''
+            Check a lazy reload() rejecting file.json keeps every record
+            readable, built or not
+        '''
+        self.storage._FileStorage__checksum = True
+        self.storage._FileStorage__lazy = True
+        self.storage._FileStorage__lazy_max = 2
+        names = {}
+        for i in range(4):
+            state = State(name="State{}".format(i))
+            self.storage.new(state)
+            names[state.id] = state.name
+        # no reference is kept, so that unbuilt records are only on disk
+        del state
+        self.storage.save()
+        before = self.storage.count(State)
+        with open("file.json", encoding="UTF8") as fd:
+            data = fd.read()
+        # replaced the way save() writes it, the index maps the old file
+        write_atomic("file.json", data.replace("State0", "Iowa0"))
+        self.assertRaises(ValueError, self.storage.reload)
+        self.assertEqual(len(self.storage.all(State)), before)
+        for id, name in names.items():
+            self.assertEqual(self.storage.get(State, id).name, name)
+
+    def test_lazy_reload_rejects_truncated_file(self):
+        '''
+            Check a lazy reload() of a truncated file.json keeps every
+            record readable, built or not
+        '''
+        self.storage._FileStorage__lazy = True
+        self.storage._FileStorage__lazy_max = 2
+        names = {}
+        for i in range(4):
+            state = State(name="State{}".format(i))
+            self.storage.new(state)
+            names[state.id] = state.name
+        # no reference is kept, so that unbuilt records are only on disk
+        del state
+        self.storage.save()
+        before = self.storage.count(State)
+        with open("file.json", encoding="UTF8") as fd:
+            data = fd.read()
+        # replaced the way save() writes it, the index maps the old file
+        write_atomic("file.json", data[:len(data) // 2])
+        self.assertRaises(ValueError, self.storage.reload)
+        self.assertEqual(len(self.storage.all(State)), before)
+        for id, name in names.items():
+            self.assertEqual(self.storage.get(State, id).name, name)
+
+    def test_reload_skips_unchanged_file(self):
+        '''
+            Check reload() keeps loaded objects when file.json is unchanged
+        '''
+        new_state = State(name="Cali")
+        self.storage.new(new_state)
+        self.storage.save()
+        self.storage.reload()
+        self.assertIs(self.storage.get(State, new_state.id), new_state)
+
+    def test_reload_loads_only_changed_records(self):
+        '''
+            Check reload() only rebuilds the records changed on disk
+        '''
+        cali = State(name="Cali")
+        iowa = State(name="Iowa")
+        self.storage.new(cali)
+        self.storage.new(iowa)
+        self.storage.save()
+        with open("file.json", encoding="UTF8") as fd:
+            content = json.load(fd)
+        content["State." + cali.id]["name"] = "California"
+        with open("file.json", "w", encoding="UTF8") as fd:
+            json.dump(content, fd)
+        self.storage.reload()
+        self.assertEqual(self.storage.get(State, cali.id).name, "California")
+        self.assertIsNot(self.storage.get(State, cali.id), cali)
+        self.assertIs(self.storage.get(State, iowa.id), iowa)
+        del content["State." + iowa.id]
+        with open("file.json", "w", encoding="UTF8") as fd:
+            json.dump(content, fd)
+        self.storage.reload()
+        self.assertIsNone(self.storage.get(State, iowa.id))
+
+    def test_reload_replays_journal_tail(self):
+        '''
+            Check reload() only replays what was appended to the journal
+        '''
+        self.storage._FileStorage__journal = True
+        cali = State(name="Cali")
+        self.storage.new(cali)
+        self.storage.save()
+        iowa = State(name="Iowa")
+        with open("file.json.log", "a", encoding="UTF8") as fd:
+            fd.write(json.dumps({"State." + iowa.id: iowa.to_dict()}) + "\n")
+        self.storage.reload()
+        self.assertIs(self.storage.get(State, cali.id), cali)
+        self.assertEqual(self.storage.get(State, iowa.id).name, "Iowa")
+
+    def test_lazy_objects_dropped_past_bound(self):
+        '''
+            Check lazy mode keeps at most __lazy_max unmodified objects
+        '''
+        self.storage._FileStorage__lazy = True
+        self.storage._FileStorage__lazy_max = 1
+        states = [State(name="State{}".format(i)) for i in range(3)]
+        for state in states:
+            self.storage.new(state)
+        before = self.storage.count(State)
+        self.storage.save()
+        resident = self.storage._FileStorage__resident
+        self.assertEqual(len(resident), 1)
+        self.assertEqual(self.storage.count(State), before)
+        for state in states:
+            found = self.storage.get(State, state.id)
+            self.assertEqual(found.name, state.name)
+            self.assertEqual(len(resident), 1)
+        self.assertEqual(len(self.storage.all(State)), before)
+
+    def test_lazy_get_skips_the_writer_lock(self):
+        '''
+            Check getting objects built lazily does not take the exclusive
+            lock, bounded or not
+        '''
+        self.storage._FileStorage__lazy = True
+        states = [State(name="State{}".format(i)) for i in range(3)]
+        for state in states:
+            self.storage.new(state)
+        self.storage.save()
+        lock = self.storage._FileStorage__lock
+        for bound in (0, 3):
+            self.storage._FileStorage__lazy_max = bound
+            with open("file.json", encoding="UTF8") as fd:
+                data = fd.read()
+            # changed elsewhere, the records are left to the index
+            write_atomic("file.json", data.replace('"name": "', '"name": "x'))
+            self.storage.reload()
+            for state in states:
+                self.storage.get(State, state.id)
+            resident = self.storage._FileStorage__resident
+            self.assertEqual(len(resident), bound)
+            with mock.patch.object(lock, "writing",
+                                   wraps=lock.writing) as writing:
+                for i in range(100):
+                    for state in states:
+                        self.storage.get(State, state.id)
+            self.assertEqual(writing.call_count, 0)
+        self.assertEqual(list(resident), ["State." + s.id for s in states])
+
+    def test_lazy_reload_indexes_changed_records(self):
+        '''
+            Check lazy reload() builds changed records only when asked for
+        '''
+        cali = State(name="Cali")
+        iowa = State(name="Iowa")
+        self.storage.new(cali)
+        self.storage.new(iowa)
+        self.storage.save()
+        self.storage._FileStorage__lazy = True
+        with open("file.json", encoding="UTF8") as fd:
+            data = fd.read()
+        with open("file.json", "w", encoding="UTF8") as fd:
+            fd.write(data.replace('"Iowa"', '"Utah"'))
+        self.storage.reload()
+        key = "State." + iowa.id
+        self.assertNotIn(key, self.storage._FileStorage__objects)
+        self.assertIs(self.storage.get(State, cali.id), cali)
+        self.assertEqual(self.storage.get(State, iowa.id).name, "Utah")
+        self.assertIn(key, self.storage._FileStorage__objects)
+
+    def test_all_load_prefetches_children(self):
+        '''
+            Check all(cls, load) builds the records of related classes
+        '''
+        cali = State(name="Cali")
+        city = City(name="Fresno", state_id=cali.id)
+        self.storage.new(cali)
+        self.storage.new(city)
+        self.storage.save()
+        self.storage._FileStorage__lazy = True
+        with open("file.json", encoding="UTF8") as fd:
+            data = fd.read()
+        with open("file.json", "w", encoding="UTF8") as fd:
+            fd.write(data.replace('"Fresno"', '"Merced"'))
+        self.storage.reload()
+        unloaded = self.storage._FileStorage__unloaded
+        self.assertIn("City." + city.id, unloaded["City"])
+        states = self.storage.all(State, load=["cities"])
+        self.assertFalse(unloaded["City"])
+        cities = states["State." + cali.id].cities
+        self.assertEqual([c.name for c in cities], ["Merced"])
+        with self.assertRaises(AttributeError):
+            self.storage.all(State, load=["places"])
+
+    def test_load_needs_class(self):
+        '''
+            Check load without a class is refused by all() and iter()
+        '''
+        self.storage.new(State(name="Cali"))
+        with self.assertRaises(ValueError):
+            self.storage.all(load=["cities"])
+        with self.assertRaises(ValueError):
+            list(self.storage.iter(load=["cities"]))
+
+    def test_partitioned_save_rewrites_dirty_partitions(self):
+        '''
+            Check the partitioned layout only rewrites changed classes
+        '''
+        self.storage._FileStorage__layout = "partitioned"
+        new_state = State(name="Cali")
+        self.storage.new(new_state)
+        self.storage.new(self.my_model)
+        self.storage.save()
+        self.assertFalse(os.path.isfile("file.json"))
+        with open("file.json.d/State.json", encoding="UTF8") as fd:
+            content = json.load(fd)
+        self.assertEqual(content["State." + new_state.id]["name"], "Cali")
+        before = os.stat("file.json.d/BaseModel.json").st_ino
+        new_state.name = "Iowa"
+        self.storage.save()
+        self.assertEqual(os.stat("file.json.d/BaseModel.json").st_ino, before)
+        with open("file.json.d/State.json", encoding="UTF8") as fd:
+            content = json.load(fd)
+        self.assertEqual(content["State." + new_state.id]["name"], "Iowa")
+
+    def test_partitioned_migrates_single_file(self):
+        '''
+            Check the partitioned layout reads and migrates file.json
+        '''
+        new_state = State(name="Cali")
+        self.storage.new(new_state)
+        self.storage.save()
+        self.storage._FileStorage__layout = "partitioned"
+        self.storage._FileStorage__shards = 4
+        new_state.name = "Iowa"
+        self.storage._FileStorage__stamp = None
+        self.storage.reload()
+        self.assertEqual(self.storage.get(State, new_state.id).name, "Iowa")
+        self.storage.compact()
+        names = [name for name in os.listdir("file.json.d")
+                 if name.startswith("State.")]
+        self.assertTrue(names)
+        found = {}
+        for name in names:
+            with open(os.path.join("file.json.d", name)) as fd:
+                found.update(json.load(fd))
+        self.assertEqual(found["State." + new_state.id]["name"], "Iowa")
+
+    def test_decode_partitions_in_parallel(self):
+        '''
+            Check partitions decoded by worker processes are complete
+        '''
+        paths = []
+        for name in ("State", "City"):
+            texts = {}
+            for i in range(3000):
+                texts["{}.{}".format(name, i)] = json.dumps(
+                    {"__class__": name, "id": str(i), "name": "x" * 300})
+            path = "file.json.{}".format(name)
+            with open(path, "w") as fd:
+                fd.write(format_snapshot(texts))
+            paths.append(path)
+        try:
+            decoded = decode_partitions(paths, 2)
+        finally:
+            for path in paths:
+                os.remove(path)
+        self.assertEqual(len(decoded[paths[0]]), 3000)
+        self.assertEqual(decoded[paths[1]]["City.7"][1]["id"], "7")
+        text = json.dumps({"__class__": "City", "id": "7", "name": "x" * 300})
+        self.assertEqual(decoded[paths[1]]["City.7"][0], record_digest(text))
+
+    def test_decode_partitions_without_fork_in_threads(self):
+        '''
+            Check partitions are not decoded by forked processes while
+            another thread runs
+        '''
+        paths = []
+        for name in ("State", "City"):
+            path = "file.json.{}".format(name)
+            with open(path, "w") as fd:
+                fd.write(format_snapshot({name + ".1": json.dumps(
+                    {"__class__": name, "id": "1", "name": "x" * 600000})}))
+            paths.append(path)
+        done = threading.Event()
+        thread = threading.Thread(target=done.wait)
+        thread.start()
+        try:
+            with mock.patch("models.engine.file_storage.ProcessPoolExecutor"
+                            ) as pool:
+                decoded = decode_partitions(paths, 2)
+        finally:
+            done.set()
+            thread.join()
+            for path in paths:
+                os.remove(path)
+        self.assertFalse(pool.called)
+        self.assertEqual(decoded[paths[0]]["State.1"][1]["id"], "1")
+
+    def test_children_follow_foreign_keys(self):
+        '''
+            Check the parent to children index follows changes
+        '''
+        cali = State(name="Cali")
+        iowa = State(name="Iowa")
+        city = City(name="Fresno", state_id=cali.id)
+        place = Place(name="Home", city_id=city.id)
+        for obj in (cali, iowa, city, place):
+            self.storage.new(obj)
+        self.assertEqual(cali.cities, [city])
+        self.assertEqual(city.places, [place])
+        city.state_id = iowa.id
+        self.assertEqual(cali.cities, [])
+        self.assertEqual(iowa.cities, [city])
+        self.storage.save()
+        self.storage.reload()
+        self.assertEqual([c.id for c in iowa.cities], [city.id])
+        self.storage.delete(city)
+        self.assertEqual(iowa.cities, [])
+
+    def test_place_amenities_follow_amenity_ids(self):
+        '''
+            Check Place.amenities are the stored amenities of amenity_ids
+        '''
+        wifi = Amenity(name="Wifi")
+        pool = Amenity(name="Pool")
+        place = Place(name="Home")
+        for obj in (wifi, pool, place):
+            self.storage.new(obj)
+        self.assertEqual(place.amenities, [])
+        place.amenity_ids = [pool.id, "missing", wifi.id]
+        self.assertEqual(place.amenities, [pool, wifi])
+        self.storage.save()
+        self.storage.reload()
+        places = self.storage.all(Place, load=["amenities"])
+        self.assertEqual([a.name for a in
+                          places["Place." + place.id].amenities],
+                         ["Pool", "Wifi"])
+
+    def test_all_returns_copy(self):
+        '''
+            Check all() is not changed by later calls to new
+        '''
+        objs = self.storage.all()
+        new_state = State()
+        self.storage.new(new_state)
+        self.assertNotIn("State." + new_state.id, objs)
+        self.assertIn("State." + new_state.id, self.storage.all())
+
+    def test_concurrent_new_save_and_all(self):
+        '''
+            Check threads creating, saving and listing objects together
+        '''
+        errors = []
+        created = []
+
+        def work():
+            try:
+                for i in range(50):
+                    new_state = State(name="s")
+                    self.storage.new(new_state)
+                    created.append(new_state)
+                    for obj in self.storage.all(State).values():
+                        obj.id
+                    if i % 10 == 0:
+                        self.storage.save()
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=work) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.storage.save()
+        self.storage.reload()
+        for new_state in created:
+            self.assertIsNotNone(self.storage.get(State, new_state.id))
+
+    def test_read_write_lock(self):
+        '''
+            Check readers share the lock and a writer waits for them
+        '''
+        lock = ReadWriteLock()
+        events = []
+
+        def read():
+            with lock.reading():
+                events.append("read")
+
+        def write():
+            with lock.writing():
+                events.append("write")
+        reader = threading.Thread(target=read)
+        writer = threading.Thread(target=write)
+        with lock.reading():
+            reader.start()
+            reader.join()
+            writer.start()
+            writer.join(0.1)
+            self.assertEqual(events, ["read"])
+            with self.assertRaises(RuntimeError):
+                with lock.writing():
+                    pass
+        writer.join()
+        self.assertEqual(events, ["read", "write"])
@@ -13,8 +13,11 @@ app = Flask(__name__)
 @app.route('/states/<state_id>', strict_slashes=False)
 def states(state_id=None):
     """display the states and cities listed in alphabetical order"""
-    states = storage.all("State")
-    if state_id is not None:
+    if state_id is None:
+        states = storage.all("State")
+    else:
+        states = {'State.' + state.id: state for state in
+                  storage.query("State").filter(id=state_id)}
         state_id = 'State.' + state_id
     return render_template('9-states.html', states=states, state_id=state_id)
 